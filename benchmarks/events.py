@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Event recording throughput and memory benchmark.
+
+Traces a long-running tracee that opens and closes sockets in a loop and
+reports how many events per second the tracer records and how much memory
+each recorded event keeps. Needs to be run as root.
+
+    sudo python benchmarks/events.py --count 20000
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from network_testing import debug
+
+TRACEE = """
+import socket, sys
+for i in range(int(sys.argv[1])):
+    socket.socket(socket.AF_INET, socket.SOCK_DGRAM).close()
+"""
+
+
+def trace(count, seccomp):
+    debugger = debug.SyscallDebugger(seccomp=seccomp)
+    started = time.time()
+    process = debugger.new_child('client', [sys.executable, '-c', TRACEE, str(count)])
+    debugger.wait(process)
+    elapsed = time.time() - started
+    return debugger, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure event recording throughput and memory.")
+    parser.add_argument("--count", type=int, default=20000, help="Number of sockets the tracee opens and closes.")
+    parser.add_argument("--no-seccomp", action="store_true", help="Stop on every syscall instead of using a seccomp filter.")
+    options = parser.parse_args()
+
+    seccomp = not options.no_seccomp
+
+    debugger, elapsed = trace(options.count, seccomp)
+    events = len(debugger.events)
+    print("Mode: {}".format(debugger.mode))
+    print("Events: {}, tracer stops: {}".format(events, debugger.stops))
+    print("Throughput: {:.0f} events/s, {:.0f} stops/s".format(events / elapsed, debugger.stops / elapsed))
+    debugger.quit()
+    del debugger
+
+    if tracemalloc is None:
+        print("Memory: tracemalloc not available")
+        return
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    debugger, elapsed = trace(options.count, seccomp)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print("Memory: {:.0f} bytes/event".format(retained / float(len(debugger.events))))
+    # Formatting is deferred, include it separately.
+    started = time.time()
+    for event in debugger.events:
+        str(event)
+    print("Formatting: {:.0f} events/s".format(len(debugger.events) / (time.time() - started)))
+    debugger.quit()
+
+
+if __name__ == '__main__':
+    main()
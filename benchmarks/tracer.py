@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Tracer overhead benchmark.
+
+Runs synthetic tracees with controlled syscall mixes both untraced and
+under SyscallDebugger and reports tracer stops per second, wall-clock
+overhead and tracer CPU time per stop. Needs to be run as root.
+
+    sudo python benchmarks/tracer.py
+    sudo python benchmarks/tracer.py --count 2000 connect-storm fork
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from network_testing import debug
+
+# Each workload is a Python script run with the iteration count argument.
+WORKLOADS = {
+    # Connections to a local listener, each accepted and closed.
+    'connect-storm': """
+import socket, sys
+listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+listener.bind(('127.0.0.1', 0))
+listener.listen(128)
+for i in range(int(sys.argv[1])):
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    client.connect(listener.getsockname())
+    listener.accept()[0].close()
+    client.close()
+""",
+    # Polling a socket that never becomes readable.
+    'poll-loop': """
+import select, socket, sys
+left, right = socket.socketpair()
+poller = select.poll()
+poller.register(left, select.POLLIN)
+for i in range(int(sys.argv[1])):
+    poller.poll(0)
+""",
+    # Children that exit immediately.
+    'fork': """
+import os, sys
+for i in range(int(sys.argv[1]) // 10):
+    pid = os.fork()
+    if not pid:
+        os._exit(0)
+    os.waitpid(pid, 0)
+""",
+    # Syscalls the tracer is not interested in.
+    'noise': """
+import os, sys
+for i in range(int(sys.argv[1]) * 10):
+    os.getppid()
+""",
+}
+
+
+def command(workload, count):
+    return [sys.executable, '-c', WORKLOADS[workload], str(count)]
+
+
+def cpu_time():
+    if hasattr(time, 'process_time'):
+        return time.process_time()
+    times = os.times()
+    return times[0] + times[1]
+
+
+def run_untraced(workload, count):
+    started = time.time()
+    subprocess.check_call(command(workload, count))
+    return time.time() - started
+
+
+def run_traced(workload, count, seccomp):
+    debugger = debug.SyscallDebugger(seccomp=seccomp)
+    started = time.time()
+    cpu_started = cpu_time()
+    process = debugger.new_child('client', command(workload, count))
+    event = debugger.wait(process)
+    elapsed = time.time() - started
+    cpu = cpu_time() - cpu_started
+    debugger.quit()
+    if getattr(event, 'exitcode', None) != 0:
+        raise RuntimeError("Workload {} failed.".format(workload))
+    return debugger.mode, debugger.stops, elapsed, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure tracer overhead with synthetic tracees.")
+    parser.add_argument("--count", type=int, default=5000, help="Workload iteration count.")
+    parser.add_argument("--no-seccomp", action="store_true", help="Only measure tracing of every syscall.")
+    parser.add_argument("workloads", nargs="*", help="Workloads to run ({}).".format(", ".join(sorted(WORKLOADS))))
+    options = parser.parse_args()
+
+    workloads = options.workloads or sorted(WORKLOADS)
+    for workload in workloads:
+        if workload not in WORKLOADS:
+            parser.error("Unknown workload '{}'.".format(workload))
+    modes = [False] if options.no_seccomp else [True, False]
+
+    print("{:<14} {:<8} {:>8} {:>9} {:>9} {:>9} {:>10}".format(
+        "workload", "mode", "stops", "stops/s", "wall [s]", "overhead", "us/stop"))
+    for workload in workloads:
+        untraced = run_untraced(workload, options.count)
+        print("{:<14} {:<8} {:>8} {:>9} {:>9.3f} {:>9} {:>10}".format(workload, "none", "-", "-", untraced, "-", "-"))
+        for seccomp in modes:
+            mode, stops, elapsed, cpu = run_traced(workload, options.count, seccomp)
+            print("{:<14} {:<8} {:>8} {:>9.0f} {:>9.3f} {:>8.1f}x {:>10.1f}".format(
+                workload, mode, stops, stops / elapsed, elapsed, elapsed / untraced, cpu / max(stops, 1) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
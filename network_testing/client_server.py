@@ -5,7 +5,10 @@ import argparse
 import logging
 import os
 
-from .test_suite import TestCase, TestSuite, testcase_path
+from .client_server_submit import default_socket
+from .daemon import Daemon
+from .database import default_database
+from .test_suite import TestCase, TestSuite, dependencies, merge_results
 
 
 def main():
@@ -15,6 +18,39 @@ def main():
     parser.add_argument("--list-scenarios", action="store_true", help="List testcases and scenarios.")
     parser.add_argument("--deps", action="store_true", help="List dependencies.")
     parser.add_argument("--outdir", default="./json-output/", help="List dependencies.")
+    parser.add_argument("--cache", metavar="DIR", default="./result-cache/",
+                        help="Directory with cached results, kept between runs.")
+    parser.add_argument("--no-cache", action="store_true", help="Run all testcases even if a cached result is available.")
+    parser.add_argument("--database", metavar="PATH", default=default_database,
+                        help="SQLite database to add results to.")
+    parser.add_argument("--no-seccomp", action="store_true", help="Stop on every syscall instead of using a seccomp filter.")
+    parser.add_argument("--count-read-write", action="store_true",
+                        help="Also count data sent and received on sockets with read(), write() and sendfile().")
+    parser.add_argument("--no-pool", action="store_true", help="Create and destroy network namespaces for every testcase.")
+    parser.add_argument("--no-early-exit", action="store_true", help="Let clients run to completion to validate their exit codes.")
+    parser.add_argument("--record", metavar="DIR", help="Save event streams of scenarios for later replay.")
+    parser.add_argument("--replay", metavar="DIR", help="Analyze recorded event streams instead of running testcases.")
+    parser.add_argument("--events-jsonl", action="store_true",
+                        help="Write traced events of every run to a JSON Lines file in the output directory.")
+    parser.add_argument("--repeat", type=int, default=1, metavar="N",
+                        help="Run each scenario N times and summarize timing properties.")
+    parser.add_argument("--netem", action="append", default=[], metavar="FAMILY=PARAMS",
+                        help="Netem parameters for ip4 or ip6 in the impaired scenario, e.g. ip6='delay 300ms 20ms loss 1%%'.")
+    parser.add_argument("--load-clients", type=int, metavar="N", help="Number of clients in the load scenario.")
+    parser.add_argument("--load-concurrency", type=int, metavar="N", help="Clients running at once in the load scenario.")
+    parser.add_argument("--load-duration", type=float, metavar="SECONDS",
+                        help="Time to keep starting clients in the load scenario.")
+    parser.add_argument("--trace-server-only", action="store_true",
+                        help="Don't trace clients of the load scenario to keep the overhead down.")
+    parser.add_argument("--shard", metavar="K/N", help="Only run the K-th of N parts of the selected testcases.")
+    parser.add_argument("--durations", metavar="DIR",
+                        help="Output directory of an earlier run to balance shards and workers by testcase duration, "
+                             "defaults to the output directory for workers.")
+    parser.add_argument("--merge", action="append", default=[], metavar="DIR",
+                        help="Combine results of output directories, e.g. of shards, into the output directory.")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Run testcases in parallel worker processes.")
+    parser.add_argument("--serve", nargs="?", const=default_socket, metavar="SOCKET",
+                        help="Keep running and accept jobs from test-client-server-submit on a Unix socket.")
     parser.add_argument("testcases", nargs="?")
     parser.add_argument("scenarios", nargs="?")
     options = parser.parse_args()
@@ -22,10 +58,70 @@ def main():
     if options.debug:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    netem = {}
+    for item in options.netem:
+        family, _, params = item.partition('=')
+        if family not in ('ip4', 'ip6') or not params:
+            parser.error("Invalid netem impairment '{}'.".format(item))
+        netem[family] = params
+
+    if options.repeat < 1:
+        parser.error("Invalid repeat count '{}'.".format(options.repeat))
+
+    load = {'server_only': options.trace_server_only}
+    for key in 'clients', 'concurrency', 'duration':
+        value = getattr(options, 'load_' + key)
+        if value is not None:
+            if value <= 0:
+                parser.error("Invalid load {} '{}'.".format(key, value))
+            load[key] = value
+
+    if options.merge:
+        try:
+            result = merge_results(options.merge, options.outdir)
+        except ValueError as error:
+            parser.error(str(error))
+        exit(0 if result else 1)
+
+    shard = None
+    if options.shard:
+        index, _, count = options.shard.partition('/')
+        try:
+            shard = int(index), int(count)
+        except ValueError:
+            shard = None
+        if not shard or not 1 <= shard[0] <= shard[1]:
+            parser.error("Invalid shard '{}'.".format(options.shard))
+
     testcases = options.testcases and options.testcases.split(',')
     scenarios = options.scenarios and options.scenarios.split(',')
 
-    suite = TestSuite(testcases, scenarios)
+    suite_options = {
+        'seccomp': not options.no_seccomp,
+        'count_read_write': options.count_read_write,
+        'pooled': not options.no_pool,
+        'early_exit': not options.no_early_exit,
+        'record': options.record,
+        'replay': options.replay,
+        'repeat': options.repeat,
+        'netem': netem,
+        'load': load,
+        'outdir': options.outdir,
+        'stream_events': options.events_jsonl,
+        'cache': None if options.no_cache else options.cache,
+        'database': options.database,
+        'shard': shard,
+        'durations': options.durations,
+    }
+
+    if options.serve:
+        if os.geteuid() != 0 and not options.replay:
+            print("You have to be root to run the test driver. Please use sudo.")
+            exit(1)
+        Daemon(options.serve, options.jobs, **suite_options).serve()
+        exit(0)
+
+    suite = TestSuite(testcases, scenarios, **suite_options)
     if options.list_testcases:
         for testcase in suite.testcases:
             print(testcase.name)
@@ -35,24 +131,18 @@ def main():
             print(scenario.name)
         exit(0)
     elif options.deps:
-        dependencies = set()
+        packages = set()
         for testcase in suite.testcases:
-            try:
-                with open(os.path.join(testcase_path, testcase.name, 'deps')) as deps_file:
-                    for dependency in deps_file.read().splitlines():
-                        if dependency:
-                            dependencies.add(dependency)
-            except IOError:
-                pass
-        for dependency in sorted(dependencies):
-            print(dependency)
+            packages.update(dependencies(testcase.name))
+        for package in sorted(packages):
+            print(package)
         exit(0)
     else:
-        if os.geteuid() != 0:
+        if os.geteuid() != 0 and not options.replay:
             print("You have to be root to run the test driver. Please use sudo.")
             exit(1)
 
-        suite.run()
+        suite.run(options.jobs)
         suite.save(options.outdir)
         suite.report()
 
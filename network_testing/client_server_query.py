@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Query the history of test results"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+from .database import ResultDatabase, changed, default_database
+
+
+def timestamp(started):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started))
+
+
+def value_str(value):
+    return '-' if value is None else str(value)
+
+
+def show_runs(database, options):
+    for run, started, kernel, testcases, failed, cached in database.runs(options.limit):
+        print("{:6} {} {:24} {} testcases, {} failed, {} cached".format(
+            run, timestamp(started), kernel, testcases, failed or 0, cached or 0))
+
+
+def show_trend(database, options):
+    previous = None
+    for index, (run, started, value, status, packages) in enumerate(database.trend(options.testcase, options.property)):
+        jump = index and changed(previous, value, options.threshold)
+        print("{:6} {} {:>12} {:4} {}".format(run, timestamp(started), value_str(value), status, '*' if jump else ''))
+        previous = value
+
+
+def show_regressions(database, options):
+    for name, prop, previous, previous_status, value, status in database.regressions(options.run, options.threshold):
+        print("{} {}: {} ({}) -> {} ({})".format(name, prop, value_str(previous), previous_status,
+                                                 value_str(value), status))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the database of test results.")
+    parser.add_argument("--database", default=default_database, help="SQLite database with results.")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Relative change of a float property considered significant.")
+    commands = parser.add_subparsers(dest="command")
+    runs = commands.add_parser("runs", help="List recent runs.")
+    runs.add_argument("--limit", type=int, default=20, help="Number of runs to list.")
+    runs.set_defaults(function=show_runs)
+    trend = commands.add_parser("trend", help="Show values of a property over time, * marks significant changes.")
+    trend.add_argument("testcase")
+    trend.add_argument("property")
+    trend.set_defaults(function=show_trend)
+    regressions = commands.add_parser("regressions", help="Show properties that changed since the previous run.")
+    regressions.add_argument("--run", type=int, help="Run to check, defaults to the last one.")
+    regressions.set_defaults(function=show_regressions)
+    options = parser.parse_args()
+
+    if not getattr(options, 'function', None):
+        parser.error("No command given.")
+    if not os.path.exists(options.database):
+        print("Database not found: {}".format(options.database), file=sys.stderr)
+        exit(1)
+
+    database = ResultDatabase(options.database)
+    try:
+        options.function(database, options)
+    finally:
+        database.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Submit testcases to a test driver running with --serve
+
+Only the standard library is used to keep the startup time low.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import socket
+import sys
+
+default_socket = '/run/network-testing.sock'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit testcases to a test driver started with --serve.")
+    parser.add_argument("--socket", default=default_socket, help="Unix socket of the test driver.")
+    parser.add_argument("testcases", nargs="?")
+    parser.add_argument("scenarios", nargs="?")
+    options = parser.parse_args()
+
+    request = {
+        'testcases': options.testcases and options.testcases.split(','),
+        'scenarios': options.scenarios and options.scenarios.split(','),
+    }
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(options.socket)
+    except socket.error as error:
+        print("Cannot connect to {}: {}".format(options.socket, error), file=sys.stderr)
+        exit(1)
+    sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+
+    summary = None
+    for line in sock.makefile('rb'):
+        data = json.loads(line.decode('utf-8'))
+        if 'error' in data:
+            print(data['error'], file=sys.stderr)
+            exit(1)
+        elif 'testcase' in data:
+            print(data['output'], end='')
+            sys.stdout.flush()
+        else:
+            summary = data
+    sock.close()
+
+    if summary is None:
+        print("Connection to the test driver was lost.", file=sys.stderr)
+        exit(1)
+    if summary['makespan'] is not None:
+        print("Testcases took {:.3f} s.".format(summary['makespan']))
+    exit(0 if summary['result'] == 'PASS' else 1)
+
+if __name__ == '__main__':
+    main()
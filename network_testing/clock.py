@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""Monotonic clock unaffected by system time adjustments."""
+import time
+
+if hasattr(time, 'monotonic_ns'):
+    monotonic_ns = time.monotonic_ns
+elif hasattr(time, 'monotonic'):
+    def monotonic_ns():
+        return int(time.monotonic() * 1e9)
+else:
+    # Python 2 has no monotonic clock in the standard library.
+    def monotonic_ns():
+        return int(time.time() * 1e9)
+
+
+def monotonic():
+    return monotonic_ns() / 1e9
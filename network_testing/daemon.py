@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Long running test driver accepting jobs over a Unix socket."""
+
+import json
+import multiprocessing
+import os
+import threading
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+from .logger import logger
+from .test_suite import CachedResult, TestSuite, ignore_interrupt, result_str
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Run testcases requested by a client and stream the results back.
+
+    The request is a JSON line with optional lists of testcases and
+    scenarios. Each result is sent as a JSON line as soon as it is
+    available and the last line summarizes the job.
+    """
+
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.connected = True
+
+    def send(self, data):
+        # Results are still saved when the client goes away.
+        if not self.connected:
+            return
+        try:
+            self.wfile.write((json.dumps(data, sort_keys=True) + '\n').encode('utf-8'))
+            self.wfile.flush()
+        except (IOError, OSError):
+            logger.info("Client disconnected.")
+            self.connected = False
+
+    def send_result(self, testcase):
+        self.send({
+            'testcase': testcase.name,
+            'result': result_str[testcase.result],
+            'cached': isinstance(testcase, CachedResult),
+            'output': testcase.output,
+        })
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            testcases = request.get('testcases')
+            scenarios = request.get('scenarios')
+        except (ValueError, AttributeError) as error:
+            self.send({'error': "Invalid request: {}".format(error)})
+            return
+        try:
+            suite = self.server.run(testcases, scenarios, self.send_result)
+        except ValueError as error:
+            self.send({'error': str(error)})
+            return
+        except Exception as error:
+            logger.exception("Job failed.")
+            self.send({'error': "Job failed: {}".format(error)})
+            return
+        self.send({
+            'result': result_str[suite.result],
+            'testcases': len(suite.testcases),
+            'makespan': suite.makespan,
+            'predicted': suite.predicted,
+        })
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Test driver that keeps its worker processes between jobs.
+
+    Workers are forked once with all modules imported and keep their
+    network namespaces between testcases. Testcases of all jobs are fed to
+    them from a single queue. Workers write the files of a testcase
+    themselves, so jobs sharing testcases are run one after another.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, jobs=1, **options):
+        # Import the tracer before the workers are forked so that they
+        # don't have to load python-ptrace for their first testcase.
+        from . import debug
+
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, JobHandler)
+        self.path = path
+        self.jobs = jobs
+        self.options = options
+        self.workers = multiprocessing.Pool(jobs, ignore_interrupt)
+        self.lock = threading.Lock()
+        # Names of testcases of the running jobs.
+        self.running = set()
+        self.finished = threading.Condition(self.lock)
+
+    def run(self, testcases, scenarios, callback):
+        suite = TestSuite(testcases, scenarios, **self.options)
+        unknown = set(testcases or []) - set(testcase.name for testcase in suite.testcases)
+        if unknown:
+            raise ValueError("Unknown testcases: {}.".format(', '.join(sorted(unknown))))
+        names = set(testcase.name for testcase in suite.testcases)
+        with self.finished:
+            while names & self.running:
+                self.finished.wait()
+            self.running |= names
+        try:
+            logger.info("Running {}.".format(', '.join(testcase.name for testcase in suite.testcases)))
+            suite.run(self.jobs, self.workers, callback)
+            with self.lock:
+                suite.save(self.options['outdir'])
+        finally:
+            with self.finished:
+                self.running -= names
+                self.finished.notify_all()
+        return suite
+
+    def serve(self):
+        logger.info("Waiting for jobs on {}.".format(self.path))
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            os.unlink(self.path)
+            self.workers.close()
+            self.workers.join()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""History of test results in an SQLite database."""
+
+import json
+import os
+import sqlite3
+import time
+
+# Kept outside of the output directory that is replaced by every run.
+default_database = './results.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    kernel TEXT,
+    options TEXT
+);
+CREATE TABLE IF NOT EXISTS testcases (
+    id INTEGER PRIMARY KEY,
+    run INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    status TEXT,
+    cached INTEGER NOT NULL DEFAULT 0,
+    packages TEXT
+);
+CREATE INDEX IF NOT EXISTS testcases_name ON testcases (name, run);
+CREATE INDEX IF NOT EXISTS testcases_run ON testcases (run);
+CREATE TABLE IF NOT EXISTS properties (
+    testcase INTEGER NOT NULL REFERENCES testcases (id),
+    name TEXT NOT NULL,
+    value,
+    status TEXT,
+    stats TEXT
+);
+CREATE INDEX IF NOT EXISTS properties_testcase ON properties (testcase, name);
+CREATE TABLE IF NOT EXISTS scenarios (
+    id INTEGER PRIMARY KEY,
+    testcase INTEGER NOT NULL REFERENCES testcases (id),
+    name TEXT NOT NULL,
+    errors TEXT,
+    setup_time REAL,
+    ready REAL,
+    decided REAL,
+    tracer_stops INTEGER
+);
+CREATE INDEX IF NOT EXISTS scenarios_testcase ON scenarios (testcase);
+CREATE TABLE IF NOT EXISTS events (
+    scenario INTEGER NOT NULL REFERENCES scenarios (id),
+    socket TEXT NOT NULL,
+    socket_index INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    str TEXT,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS events_scenario ON events (scenario);
+"""
+
+
+def changed(previous, value, threshold):
+    """Whether a property value changed significantly between two runs."""
+    if isinstance(value, float) and isinstance(previous, float):
+        return abs(value - previous) > threshold * max(abs(previous), 1e-3)
+    return value != previous
+
+
+class ResultDatabase(object):
+    """Results of all test runs.
+
+    Each run of the test suite adds a row to the runs table, its testcases
+    with their properties, scenarios and socket events refer to it.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_run(self, options, started=None):
+        cursor = self.connection.execute("INSERT INTO runs (started, kernel, options) VALUES (?, ?, ?)",
+                                         (started or time.time(), os.uname()[2], json.dumps(options, sort_keys=True)))
+        return cursor.lastrowid
+
+    def add_testcase(self, run, name, data, cached=False, packages=None):
+        """Add the result of a testcase in the format of the JSON output."""
+        execute = self.connection.execute
+        testcase = execute("INSERT INTO testcases (run, name, status, cached, packages) VALUES (?, ?, ?, ?, ?)",
+                           (run, name, data['status'], cached, packages)).lastrowid
+        self.connection.executemany(
+            "INSERT INTO properties (testcase, name, value, status, stats) VALUES (?, ?, ?, ?, ?)",
+            [(testcase, prop, value['value'], value['status'], json.dumps(value['stats']) if 'stats' in value else None)
+             for prop, value in data['properties'].items()])
+        # Scenarios and events of cached results are already stored.
+        for item in [] if cached else data['scenarios']:
+            scenario = execute(
+                "INSERT INTO scenarios (testcase, name, errors, setup_time, ready, decided, tracer_stops) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (testcase, item['name'], json.dumps([error['str'] for error in item['errors']]), item['setup-time'],
+                 item['readiness']['ready'], item['decided'], item['tracer'].get('stops'))).lastrowid
+            self.connection.executemany(
+                "INSERT INTO events (scenario, socket, socket_index, position, str, duration) VALUES (?, ?, ?, ?, ?, ?)",
+                [(scenario, kind, index, position, event['str'], event['duration'])
+                 for kind, key in (('listener', 'listeners'), ('connection', 'connections'))
+                 for index, sock in enumerate(item[key])
+                 for position, event in enumerate(sock['events'])])
+
+    def commit(self):
+        self.connection.commit()
+
+    def runs(self, limit=20):
+        return self.connection.execute(
+            "SELECT runs.id, started, kernel, COUNT(testcases.id), SUM(status = 'FAIL'), SUM(cached) "
+            "FROM runs LEFT JOIN testcases ON testcases.run = runs.id "
+            "GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?", (limit,)).fetchall()
+
+    def trend(self, testcase, prop):
+        """Values of a property over all runs that measured it."""
+        return self.connection.execute(
+            "SELECT runs.id, started, properties.value, properties.status, testcases.packages "
+            "FROM testcases JOIN runs ON runs.id = testcases.run "
+            "JOIN properties ON properties.testcase = testcases.id AND properties.name = ? "
+            "WHERE testcases.name = ? AND NOT cached ORDER BY runs.id", (prop, testcase)).fetchall()
+
+    def regressions(self, run=None, threshold=0.5):
+        """Compare properties of a run with the previous measurement.
+
+        Yields testcase and property names, previous and current values and
+        statuses for status changes, float values that changed more than
+        the relative threshold and other changed values.
+        """
+        if run is None:
+            run = self.connection.execute("SELECT MAX(run) FROM testcases WHERE NOT cached").fetchone()[0]
+        rows = self.connection.execute(
+            "SELECT testcases.name, current.name, previous.value, previous.status, current.value, current.status "
+            "FROM testcases JOIN properties AS current ON current.testcase = testcases.id "
+            "JOIN properties AS previous ON previous.name = current.name AND previous.testcase = ("
+            "    SELECT id FROM testcases AS earlier WHERE earlier.name = testcases.name "
+            "    AND earlier.run < testcases.run AND NOT earlier.cached ORDER BY earlier.run DESC LIMIT 1) "
+            "WHERE testcases.run = ? AND NOT testcases.cached ORDER BY testcases.name, current.name", (run,))
+        for name, prop, previous, previous_status, value, status in rows:
+            if status != previous_status or changed(previous, value, threshold):
+                yield name, prop, previous, previous_status, value, status
@@ -1,49 +1,223 @@
+import ptrace.binding
+import ptrace.cpu_info
 import ptrace.debugger
+import ptrace.error
 import ptrace.func_call
 import ptrace.syscall
 import ctypes
+import errno
+import os
+import signal
 import time
+import select
 import socket
+import struct
+import sys
 
 import logging
 log = logging.getLogger()
 
-SOCKET_OPERATIONS = set(['bind', 'listen', 'accept', 'connect', 'getsockopt', 'shutdown', 'close'])
-PROCESS_SYSCALLS = set(['close', 'execve', 'fork', 'clone'])
-MULTIPLEX_SYSCALLS = set(['select', 'poll', 'epoll_create1', 'epoll_ctl', 'epoll_wait'])
-TRACED_SYSCALLS = ptrace.syscall.SOCKET_SYSCALL_NAMES | PROCESS_SYSCALLS
-
-class Socket:
-    connection_attempted = False
-
-    def __init__(self, fd, domain, socktype, protocol):
-        self.events = []
-        self.fd = fd
-        self.domain = domain
-        self.socktype = socktype
-        self.protocol = protocol
-
-        log.debug(self)
-
-    def __str__(self):
-        return "Socket({fd}/{domain.text}/{socktype.text}/{protocol.text})".format(**vars(self))
+from . import clock
+from .events import SOCKADDR_SIZE, SOCKADDR_TYPE, Address, Event, Exit, Ready, Socket
 
-    def __repr__(self):
-        return repr(str(self))
-
-class Event:
-    def __init__(self, syscall_event, time):
-        self.process = syscall_event.process
-        self.origin = self.process.origin
-        self.pid = syscall_event.process.pid
-        self.name = syscall_event.name
-        self.result = syscall_event.result
-        self.arguments = syscall_event.arguments
-        self.time = time
-        self.__string = "[{time:.3f} {origin} {pid}] {format} = {result}".format(format=syscall_event.format(), **vars(self))
-
-    def __str__(self):
-        return self.__string
+SOCKET_OPERATIONS = set(['bind', 'listen', 'accept', 'connect', 'getsockopt', 'shutdown', 'close'])
+ACCEPT_SYSCALLS = set(['accept', 'accept4'])
+# Syscalls creating descriptors for existing files, only recorded for sockets.
+DESCRIPTOR_SYSCALLS = set(['dup', 'dup2', 'dup3', 'fcntl'])
+PROCESS_SYSCALLS = set(['close', 'execve', 'execveat', 'fork', 'vfork', 'clone'])
+MULTIPLEX_SYSCALLS = set(['select', 'pselect6', 'poll', 'ppoll', 'epoll_ctl', 'epoll_wait', 'epoll_pwait'])
+# Data transfers are only counted on sockets, their payloads are not read.
+SEND_SYSCALLS = set(['send', 'sendto', 'sendmsg'])
+RECEIVE_SYSCALLS = set(['recv', 'recvfrom', 'recvmsg'])
+# Generic I/O syscalls stop the tracee on every file, pipe and terminal
+# too, so they are only counted on request.
+WRITE_SYSCALLS = set(['write', 'writev', 'sendfile'])
+READ_SYSCALLS = set(['read', 'readv'])
+TRACED_SYSCALLS = ptrace.syscall.SOCKET_SYSCALL_NAMES | ACCEPT_SYSCALLS | DESCRIPTOR_SYSCALLS | PROCESS_SYSCALLS
+DECODED_SYSCALLS = TRACED_SYSCALLS | MULTIPLEX_SYSCALLS | SEND_SYSCALLS | RECEIVE_SYSCALLS
+
+CALL_OPTIONS = ptrace.func_call.FunctionCallOptions()
+
+POLLFD = struct.Struct('=ihh')
+# The kernel packs struct epoll_event on x86_64 only.
+EPOLL_EVENT = struct.Struct('=IQ' if ptrace.cpu_info.CPU_X86_64 else '=I4xQ')
+EPOLL_CTL_ADD = 1
+EPOLL_CTL_MOD = 3
+
+# Linux __WALL waitpid() flag, wait for both processes and threads.
+WALL = 0x40000000
+
+CLONE_FILES = 0x400
+O_CLOEXEC = 0o2000000
+FD_CLOEXEC = 1
+F_DUPFD = 0
+F_SETFD = 2
+F_DUPFD_CLOEXEC = 1030
+MSG_CMSG_CLOEXEC = 0x40000000
+SCM_RIGHTS = 1
+FD_PAIR = struct.Struct('=ii')
+# Native layouts of struct msghdr and struct cmsghdr.
+MSGHDR = struct.Struct('PIPNPNi')
+CMSGHDR = struct.Struct('Nii')
+
+PTRACE_O_TRACESECCOMP = 0x80
+PTRACE_EVENT_SECCOMP = 7
+PR_SET_SECCOMP = 22
+SECCOMP_MODE_FILTER = 2
+SECCOMP_RET_TRACE = 0x7ff00000
+SECCOMP_RET_ALLOW = 0x7fff0000
+BPF_LD_W_ABS = 0x20
+BPF_JEQ_K = 0x15
+BPF_RET_K = 0x06
+
+if ptrace.cpu_info.CPU_X86_64:
+    AUDIT_ARCH = 0xc000003e
+elif ptrace.cpu_info.CPU_AARCH64:
+    AUDIT_ARCH = 0xc00000b7
+else:
+    AUDIT_ARCH = None
+
+class sock_filter(ctypes.Structure):
+    _fields_ = [('code', ctypes.c_ushort), ('jt', ctypes.c_ubyte), ('jf', ctypes.c_ubyte), ('k', ctypes.c_uint)]
+
+class sock_fprog(ctypes.Structure):
+    _fields_ = [('len', ctypes.c_ushort), ('filter', ctypes.POINTER(sock_filter))]
+
+def seccomp_program(names):
+    """Build a BPF program stopping the tracee only on the named syscalls."""
+    numbers = sorted(nr for nr, name in ptrace.syscall.SYSCALL_NAMES.items() if name in names)
+    code = [
+        # Syscalls of a foreign architecture have different numbers, stop on all of them.
+        (BPF_LD_W_ABS, 0, 0, 4),
+        (BPF_JEQ_K, 1, 0, AUDIT_ARCH),
+        (BPF_RET_K, 0, 0, SECCOMP_RET_TRACE),
+        (BPF_LD_W_ABS, 0, 0, 0),
+    ]
+    code += [(BPF_JEQ_K, len(numbers) - i, 0, nr) for i, nr in enumerate(numbers)]
+    code += [
+        (BPF_RET_K, 0, 0, SECCOMP_RET_ALLOW),
+        (BPF_RET_K, 0, 0, SECCOMP_RET_TRACE),
+    ]
+    instructions = (sock_filter * len(code))(*[sock_filter(*insn) for insn in code])
+    return sock_fprog(len(code), instructions)
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+libc = ctypes.CDLL(None, use_errno=True)
+libc.process_vm_readv.restype = ctypes.c_ssize_t
+libc.process_vm_readv.argtypes = [ctypes.c_int, ctypes.POINTER(iovec), ctypes.c_ulong,
+                                  ctypes.POINTER(iovec), ctypes.c_ulong, ctypes.c_ulong]
+
+def read_memory(process, address, size):
+    """Read tracee memory using a single process_vm_readv() call."""
+    buf = ctypes.create_string_buffer(size)
+    local = iovec(ctypes.cast(buf, ctypes.c_void_p), size)
+    remote = iovec(address, size)
+    result = libc.process_vm_readv(process.pid, ctypes.byref(local), 1, ctypes.byref(remote), 1, 0)
+    if result < 0:
+        # Kernels without process_vm_readv() or unmapped memory.
+        try:
+            return process.readBytes(address, size)
+        except ptrace.error.PtraceError:
+            return b''
+    return buf.raw[:result]
+
+def read_sockaddr(process, call):
+    """Decode the socket address argument of a syscall, if any."""
+    for index, arg in enumerate(call.arguments):
+        if arg.type != SOCKADDR_TYPE or not arg.value:
+            continue
+        size = SOCKADDR_SIZE
+        # Input addresses come with their length, output addresses are
+        # only valid after a successful syscall.
+        length = call.arguments[index + 1] if index + 1 < len(call.arguments) else None
+        if length is not None and length.type == 'int':
+            size = min(size, length.value)
+        elif call.result < 0:
+            return None
+        return Address.unpack(read_memory(process, arg.value, size))
+    return None
+
+def thread_group(pid):
+    """Return the id of the process a thread belongs to."""
+    try:
+        with open('/proc/{}/status'.format(pid)) as status:
+            for line in status:
+                if line.startswith('Tgid:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return pid
+
+def read_rights(process, address):
+    """Return descriptors passed as SCM_RIGHTS in a struct msghdr."""
+    data = read_memory(process, address, MSGHDR.size)
+    if len(data) < MSGHDR.size:
+        return []
+    control, length = MSGHDR.unpack(data)[4:6]
+    if not control or length < CMSGHDR.size:
+        return []
+    data = read_memory(process, control, length)
+    align = struct.calcsize('N')
+    fds = []
+    offset = 0
+    while offset + CMSGHDR.size <= len(data):
+        size, level, kind = CMSGHDR.unpack_from(data, offset)
+        if size < CMSGHDR.size:
+            break
+        if level == socket.SOL_SOCKET and kind == SCM_RIGHTS:
+            payload = data[offset + CMSGHDR.size:offset + size]
+            fds += struct.unpack('={}i'.format(len(payload) // 4), payload[:len(payload) // 4 * 4])
+        offset += (size + align - 1) // align * align
+    return fds
+
+def install_seccomp(program):
+    if libc.prctl(PR_SET_SECCOMP, SECCOMP_MODE_FILTER, ctypes.byref(program), 0, 0) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+def create_child(command, program):
+    """Fork a traced child that installs the seccomp program before exec.
+
+    The child stops itself first so that the debugger can set the ptrace
+    options before the filter starts requesting seccomp stops.
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+    try:
+        ptrace.binding.ptrace_traceme()
+        os.kill(os.getpid(), signal.SIGSTOP)
+        os.closerange(3, os.sysconf('SC_OPEN_MAX'))
+        install_seccomp(program)
+        os.execvp(command[0], command)
+    except BaseException as error:
+        sys.stderr.write("Cannot execute {}: {}\n".format(command[0], error))
+    finally:
+        os._exit(255)
+
+_seccomp_supported = None
+
+def seccomp_supported():
+    """Check whether the kernel can run tracees under a seccomp filter."""
+    global _seccomp_supported
+
+    if _seccomp_supported is None:
+        _seccomp_supported = False
+        # Older kernels report seccomp stops before syscall-enter-stops.
+        release = tuple(int(part) for part in os.uname()[2].split('-')[0].split('.')[:2])
+        if AUDIT_ARCH is not None and release >= (4, 8):
+            pid = os.fork()
+            if not pid:
+                try:
+                    install_seccomp(seccomp_program(set()))
+                except BaseException:
+                    os._exit(1)
+                os._exit(0)
+            _seccomp_supported = os.waitpid(pid, 0)[1] == 0
+        log.debug("Seccomp tracing supported: {}".format(_seccomp_supported))
+    return _seccomp_supported
 
 class Property:
     def __init__(self, arg):
@@ -90,46 +264,230 @@ class FallbackDelay(Property):
 class Timeout(Exception):
     pass
 
+class SeccompStop(ptrace.debugger.process_event.ProcessEvent):
+    def __init__(self, process):
+        super(SeccompStop, self).__init__(process, "Process {} seccomp stop".format(process.pid))
+
+class FileTable(object):
+    """Sockets by file descriptor of a process, shared by its threads.
+
+    Sockets count the descriptors referring to them in all tables and are
+    released when the last one is closed.
+    """
+
+    def __init__(self, files=None, cloexec=None):
+        self.files = dict(files or {})
+        self.cloexec = set(cloexec or ())
+        # Sockets whose descriptor was reused before their close was seen,
+        # with the times of the reuse.
+        self.replaced = {}
+        # Processes sharing the table, e.g. clone(CLONE_FILES).
+        self.users = 1
+        for sock in self.files.values():
+            sock.references += 1
+
+    def get(self, fd):
+        return self.files.get(fd)
+
+    def add(self, fd, sock, cloexec, time):
+        """Install a socket on a newly allocated descriptor."""
+        previous = self.files.get(fd)
+        # Another thread already closed the descriptor but its stop hasn't
+        # been processed yet.
+        if previous is not None:
+            self.replaced.setdefault(fd, []).append((previous, time))
+        self._set(fd, sock, cloexec)
+
+    def replace(self, fd, sock, cloexec, time):
+        """Install a socket on a descriptor closing the former one like dup2()."""
+        previous = self.remove(fd, time)
+        if sock is not None:
+            self._set(fd, sock, cloexec)
+        return previous
+
+    def _set(self, fd, sock, cloexec):
+        self.files[fd] = sock
+        sock.references += 1
+        if cloexec:
+            self.cloexec.add(fd)
+        else:
+            self.cloexec.discard(fd)
+
+    def set_cloexec(self, fd, cloexec):
+        if cloexec:
+            self.cloexec.add(fd)
+        else:
+            self.cloexec.discard(fd)
+
+    def remove(self, fd, time, entered=None):
+        """Close a descriptor and return its socket, if any.
+
+        A close entered before the descriptor was reused by another thread
+        belongs to the oldest replaced socket.
+        """
+        replaced = self.replaced.get(fd)
+        if replaced and entered is not None:
+            for index, (sock, reused) in enumerate(replaced):
+                if entered < reused:
+                    del replaced[index]
+                    if not replaced:
+                        del self.replaced[fd]
+                    return self._release(sock, time)
+        sock = self.files.pop(fd, None)
+        self.cloexec.discard(fd)
+        return self._release(sock, time)
+
+    @staticmethod
+    def _release(sock, time):
+        if sock is not None:
+            sock.references -= 1
+            if not sock.references:
+                sock.released = time
+        return sock
+
+    def copy(self):
+        return FileTable(self.files, self.cloexec)
+
+    def execute(self, time):
+        """Close descriptors marked close-on-exec."""
+        for fd in list(self.cloexec):
+            self.remove(fd, time)
+
+    def release(self, time):
+        """Close all descriptors once the last process using the table is gone."""
+        self.users -= 1
+        if not self.users:
+            for fd in list(self.files):
+                self.remove(fd, time)
+
 class SyscallDebugger(ptrace.debugger.PtraceDebugger):
-    def __init__(self):
+    def __init__(self, seccomp=True, count_read_write=False):
         super(SyscallDebugger, self).__init__()
 
-        self.started = time.time()
+        # Monotonic time of the start, event times are relative to it.
+        self.started = clock.monotonic_ns()
         self.deadline = None
-        self.active_sockets = {}
+        # File tables by process id.
+        self.files = {}
+        # Registered epoll data mapped to file descriptors.
+        self.epoll = {}
+        # Sockets passed as SCM_RIGHTS and not received yet.
+        self.in_flight = []
         self.events = []
+        # Wait statuses of processes not registered yet (e.g. the initial
+        # SIGSTOP of a new child reaped before its parent's fork event).
+        self.pending = {}
+        self.stops = 0
+        self.send_syscalls = SEND_SYSCALLS | (WRITE_SYSCALLS if count_read_write else set())
+        self.data_syscalls = self.send_syscalls | RECEIVE_SYSCALLS | (READ_SYSCALLS if count_read_write else set())
+        self.decoded_syscalls = DECODED_SYSCALLS | self.data_syscalls
 
         self.traceFork()
+        # Threads share the file descriptors of their process.
+        self.traceClone()
+        # Exec events replace the SIGTRAP after execve() that python-ptrace
+        # would otherwise wait for even when the execve() failed.
+        self.traceExec()
+
+        # Let the kernel filter out syscalls we don't care about and only
+        # stop the tracee on those, instead of on every syscall entry and exit.
+        self.program = None
+        if seccomp and seccomp_supported():
+            self.program = seccomp_program(self.decoded_syscalls)
+            self.options |= PTRACE_O_TRACESECCOMP
+        self.mode = 'seccomp' if self.program else 'syscall'
 
     def set_timeout(self, timeout):
-        self.deadline = time.time() + timeout
-        log.debug("New deadline: {:.3f}".format(self.deadline - self.started))
+        self.deadline = clock.monotonic() + timeout
+        log.debug("New deadline: {:.3f}".format(self.deadline - self.started / 1e9))
 
     def new_child(self, origin, command):
         log.debug("Starting {origin}: {command}".format(**locals()))
 
-        process = self.addProcess(ptrace.debugger.child.createChild(command, False), True)
+        if self.program:
+            pid = create_child(command, self.program)
+        else:
+            pid = ptrace.debugger.child.createChild(command, False)
+        process = self.addProcess(pid, True)
         process.origin = origin
-        process.syscall()
+        process.tgid = pid
+        process.entered = None
+        self.ignore_syscalls(process)
+        self.resume(process)
 
         return process
 
+    def spawn(self, command):
+        """Start a process that is not traced, see reap()."""
+        log.debug("Spawning untraced: {}".format(command))
+        return os.spawnvp(os.P_NOWAIT, command[0], command)
+
+    def reap(self, pid, blocking=False):
+        """Return the wait status of an exited untraced process or None.
+
+        Waiting for traced processes reaps untraced ones as well, their
+        statuses are kept among the pending ones.
+        """
+        if pid in self.pending:
+            return self.pending.pop(pid)
+        found, status = os.waitpid(pid, 0 if blocking else os.WNOHANG)
+        return status if found else None
+
+    def ignore_syscalls(self, process):
+        # Don't decode arguments of syscalls that are thrown away anyway.
+        process.syscall_state.ignore_callback = lambda syscall: syscall.name not in self.decoded_syscalls
+
+    def resume(self, process, signum=0):
+        # Keep stepping to the exit of a syscall interrupted by a fork event
+        # or a signal after its seccomp stop.
+        if self.program and process.syscall_state.next_event != 'exit':
+            process.cont(signum)
+        else:
+            process.syscall(signum)
+
     def wait(self, script=None, syscall=None):
+        syscalls = (syscall,) if isinstance(syscall, str) else syscall or ()
         while self.dict:
             try:
                 process = self.waitSyscall().process
-                event = Event(process.syscall_state.event(ptrace.func_call.FunctionCallOptions()), time.time() - self.started)
+                stopped = self.elapsed_ns()
+                call = process.syscall_state.event(CALL_OPTIONS)
             except ptrace.debugger.process_event.NewProcessEvent as event:
                 process = event.process
                 origin = process.origin = process.parent.origin
-
-                log.info("[{}] New process: {}".format(origin, process.pid))
-
-                event.process.parent.syscall()
+                # Clone events are reported for threads as well as for other clones.
+                process.tgid = thread_group(process.pid) if process.is_thread else process.pid
+                process.entered = None
+                if process.tgid == process.pid:
+                    self.inherit(process)
+                self.ignore_syscalls(process)
+
+                if process.tgid != process.pid:
+                    log.info("[{}] New thread: {}/{}".format(origin, process.tgid, process.pid))
+                else:
+                    log.info("[{}] New process: {}".format(origin, process.pid))
+
+                self.resume(event.process.parent)
+                self.resume(process)
+            except ptrace.debugger.process_event.ProcessExecution as event:
+                # Step to the execve() exit.
+                event.process.syscall()
+            except SeccompStop as event:
+                # Decode the syscall entry and step to its exit.
+                process = event.process
+                process.entered = self.elapsed_ns()
+                process.syscall_state.event(CALL_OPTIONS)
                 process.syscall()
             except ptrace.debugger.process_event.ProcessExit as event:
                 process = event.process
-                event.origin = process.origin
+                # Threads share the exit code of their process.
+                if process.tgid != process.pid:
+                    log.debug("[{}] Thread exited: {}/{}".format(process.origin, process.tgid, process.pid))
+                    continue
+                table = self.files.pop(process.pid, None)
+                if table:
+                    table.release(self.elapsed_ns())
+                event = Exit(process.origin, process.pid, event.exitcode, event.signum, self.elapsed())
 
                 log.debug("[{}] Process exited: {} {}".format(event.origin, process.pid, event.exitcode))
                 self.add_event(event)
@@ -141,45 +499,83 @@ class SyscallDebugger(ptrace.debugger.PtraceDebugger):
                 origin = process.origin
                 log.debug("[{}] Signal received: {} {}".format(origin, process.pid, event.signum))
 
-                process.syscall(event.signum & ~0x80)
+                self.resume(process, event.signum & ~0x80)
             else:
-                # Skip entered system calls.
-                if event.result is None:
-                    process.syscall()
+                # Skip entered and ignored system calls.
+                if call is None or call.result is None:
+                    process.entered = stopped
+                    self.resume(process)
+                    continue
+                if call.name in MULTIPLEX_SYSCALLS:
+                    self.multiplex(process, call, stopped)
+                    self.resume(process)
                     continue
+                if call.name in self.data_syscalls:
+                    self.transfer(process, call, stopped)
+                    # Plain reads and writes are not worth an event.
+                    if call.name not in TRACED_SYSCALLS:
+                        self.resume(process)
+                        continue
+                event = Event(call, process.entered, stopped, read_sockaddr(process, call))
 
                 # Handle socket related system calls.
-                if event.name in ('socket', 'accept'):
+                table = self.table(process)
+                if event.name == 'socket' or event.name in ACCEPT_SYSCALLS:
                     if event.name == 'socket':
                         event.socket = Socket(event.result, *event.arguments)
                         event.socket.events.append(event)
-                    elif event.name == 'accept':
-                        listener = self.active_sockets[event.pid, event.arguments[0].value]
-                        event.socket = Socket(event.result, listener.domain, listener.socktype, listener.protocol)
-                        event.socket.events.append(event)
-                    if event.socket.fd >= 0:
-                        self.active_sockets[event.pid, event.socket.fd] = event.socket
+                        cloexec = event.arguments[1].value & socket.SOCK_CLOEXEC
+                    else:
+                        listener = table.get(event.arguments[0].value)
+                        if listener:
+                            event.socket = Socket(event.result, listener.domain, listener.socktype, listener.protocol)
+                            event.socket.events.append(event)
+                        cloexec = event.name == 'accept4' and event.arguments[3].value & socket.SOCK_CLOEXEC
+                    if event.socket and event.socket.fd >= 0:
+                        table.add(event.socket.fd, event.socket, cloexec, event.exited)
+                elif event.name == 'socketpair':
+                    if event.result == 0:
+                        data = read_memory(process, event.arguments[3].value, FD_PAIR.size)
+                        if len(data) == FD_PAIR.size:
+                            cloexec = event.arguments[1].value & socket.SOCK_CLOEXEC
+                            for fd in FD_PAIR.unpack(data):
+                                sock = Socket(fd, *event.arguments[:3])
+                                table.add(fd, sock, cloexec, event.exited)
+                                # The event is recorded with the first socket.
+                                if event.socket is None:
+                                    event.socket = sock
+                                    sock.events.append(event)
                 elif event.name == 'close':
-                    event.socket = self.active_sockets.pop((event.pid, event.arguments[0].value), None)
+                    event.socket = table.remove(event.arguments[0].value, event.exited, event.entered)
                     if event.socket:
                         event.socket.events.append(event)
                     if not event.socket:
-                        process.syscall()
+                        self.resume(process)
+                        continue
+                elif event.name in DESCRIPTOR_SYSCALLS:
+                    event.socket = self.duplicate(table, event)
+                    if not event.socket:
+                        self.resume(process)
                         continue
+                    event.socket.events.append(event)
+                elif event.name in ('execve', 'execveat'):
+                    if event.result == 0:
+                        self.execute(process)
                 elif event.name in SOCKET_OPERATIONS:
-                    event.socket = self.active_sockets.get((event.pid, event.arguments[0].value))
+                    event.socket = table.get(event.arguments[0].value)
                     if event.socket:
                         event.socket.events.append(event)
+                        if event.name == 'connect':
+                            event.socket.connecting = event.result == -errno.EINPROGRESS
+                if event.name in ('sendmsg', 'recvmsg') and event.result >= 0:
+                    self.pass_rights(process, table, event)
 
                 # Handle syscalls that need to read process memory.
-                if event.name == 'getsockopt':
-                    if event.arguments[1].value != socket.SOL_SOCKET:
-                        return
-                    if event.arguments[2].value != socket.SO_ERROR:
-                        return
+                if event.name == 'getsockopt' and event.arguments[1].value == socket.SOL_SOCKET \
+                        and event.arguments[2].value == socket.SO_ERROR:
                     arg = event.arguments[3]
 
-                    arg.value = event.process.readStruct(arg.value, ctypes.c_int)
+                    arg.value = process.readStruct(arg.value, ctypes.c_int)
                     arg.text = "[{}]".format(arg.value)
 
                 # Append all traced system calls.
@@ -187,26 +583,216 @@ class SyscallDebugger(ptrace.debugger.PtraceDebugger):
                     log.debug(event)
                     self.add_event(event)
 
-                    # Break loop if we reached the requested origin/syscall pair.
-                    if event.origin == script.origin and event.name == syscall:
-                        process.syscall()
+                    # Break loop if we reached one of the requested origin/syscall pairs.
+                    if event.origin == script.origin and event.name in syscalls:
+                        self.resume(process)
                         return event
-                elif event.name in MULTIPLEX_SYSCALLS:
-                    log.debug(event)
 
-                process.syscall()
+                self.resume(process)
+
+    def table(self, process):
+        table = self.files.get(process.tgid)
+        if table is None:
+            table = self.files[process.tgid] = FileTable()
+        return table
+
+    def inherit(self, process):
+        """Copy or share the file table of the parent of a new process."""
+        parent = self.table(process.parent)
+        syscall = process.parent.syscall_state.syscall
+        if syscall is not None and syscall.name == 'clone' and syscall.arguments[0].value & CLONE_FILES:
+            parent.users += 1
+            self.files[process.tgid] = parent
+        else:
+            self.files[process.tgid] = parent.copy()
+
+    def execute(self, process):
+        """Close descriptors marked close-on-exec after a successful exec."""
+        table = self.table(process)
+        # Exec unshares a file table shared with other processes.
+        if table.users > 1:
+            table.users -= 1
+            table = self.files[process.tgid] = table.copy()
+        table.execute(self.elapsed_ns())
+
+    @staticmethod
+    def duplicate(table, event):
+        """Track dup(), dup2(), dup3() and fcntl(), return the socket involved."""
+        args = [arg.value for arg in event.arguments]
+        sock = table.get(args[0])
+        if event.result < 0:
+            return sock
+        if event.name == 'dup' and sock:
+            table.add(event.result, sock, False, event.exited)
+        elif event.name in ('dup2', 'dup3') and args[0] != args[1]:
+            cloexec = event.name == 'dup3' and args[2] & O_CLOEXEC
+            # The descriptor is closed first even when it isn't replaced by a socket.
+            return table.replace(args[1], sock, cloexec, event.exited) or sock
+        elif event.name == 'fcntl' and sock:
+            if args[1] in (F_DUPFD, F_DUPFD_CLOEXEC):
+                table.add(event.result, sock, args[1] == F_DUPFD_CLOEXEC, event.exited)
+            elif args[1] == F_SETFD:
+                table.set_cloexec(args[0], args[2] & FD_CLOEXEC)
+        return sock
+
+    def pass_rights(self, process, table, event):
+        """Install sockets passed between processes as SCM_RIGHTS."""
+        fds = read_rights(process, event.arguments[1].value)
+        if not fds:
+            return
+        if event.name == 'sendmsg':
+            self.in_flight.append([table.get(fd) for fd in fds])
+            return
+        # Received descriptors are matched with the oldest message of the same size.
+        for index, sockets in enumerate(self.in_flight):
+            if len(sockets) == len(fds):
+                del self.in_flight[index]
+                break
+        else:
+            return
+        cloexec = event.arguments[2].value & MSG_CMSG_CLOEXEC
+        for fd, sock in zip(fds, sockets):
+            if sock is not None:
+                table.add(fd, sock, cloexec, event.exited)
+
+    def multiplex(self, process, call, stopped):
+        """Attribute readiness reported by select, poll or epoll to connecting sockets."""
+        args = [arg.value for arg in call.arguments]
+        if call.name == 'epoll_ctl':
+            if call.result == 0 and args[1] in (EPOLL_CTL_ADD, EPOLL_CTL_MOD) and args[3]:
+                data = read_memory(process, args[3], EPOLL_EVENT.size)
+                if len(data) == EPOLL_EVENT.size:
+                    self.epoll.setdefault((process.tgid, args[0]), {})[EPOLL_EVENT.unpack(data)[1]] = args[2]
+            return
+        if call.result <= 0:
+            return
+
+        ready = []
+        if call.name in ('poll', 'ppoll'):
+            data = read_memory(process, args[0], args[1] * POLLFD.size)
+            for offset in range(0, len(data) - POLLFD.size + 1, POLLFD.size):
+                fd, events, revents = POLLFD.unpack_from(data, offset)
+                if revents:
+                    ready.append((fd, revents))
+        elif call.name in ('select', 'pselect6'):
+            size = (args[0] + 63) // 64 * 8
+            for index, flag in ((1, select.POLLIN), (2, select.POLLOUT), (3, select.POLLPRI)):
+                if not args[index]:
+                    continue
+                bits = bytearray(read_memory(process, args[index], size))
+                ready += [(fd, flag) for fd in range(min(args[0], len(bits) * 8)) if bits[fd // 8] & 1 << fd % 8]
+        elif call.name in ('epoll_wait', 'epoll_pwait'):
+            table = self.epoll.get((process.tgid, args[0]), {})
+            data = read_memory(process, args[1], call.result * EPOLL_EVENT.size)
+            for offset in range(0, len(data) - EPOLL_EVENT.size + 1, EPOLL_EVENT.size):
+                events, value = EPOLL_EVENT.unpack_from(data, offset)
+                ready.append((table.get(value, value & 0xffffffff), events))
+
+        for fd, flags in ready:
+            sock = self.table(process).get(fd)
+            if not sock or not sock.connecting or not flags & (select.POLLOUT | select.POLLERR | select.POLLHUP):
+                continue
+            sock.connecting = False
+            event = Ready(process.origin, process.tgid, process.pid, call.name, fd, flags, stopped, sock)
+            sock.events.append(event)
+            log.debug(event)
+            self.add_event(event)
+
+    def transfer(self, process, call, stopped):
+        """Count data sent or received on a traced socket."""
+        if call.result < 0:
+            return
+        sock = self.table(process).get(call.arguments[0].value)
+        if sock:
+            sock.transfer(call.name in self.send_syscalls, call.result, stopped)
+
+    def elapsed_ns(self):
+        return clock.monotonic_ns() - self.started
+
+    def elapsed(self):
+        return self.elapsed_ns() / 1e9
 
     def quit(self):
-        log.debug("[{:.3f}] Quitting debugger.".format(time.time() - self.started))
+        log.debug("[{:.3f}] Quitting debugger.".format(self.elapsed()))
         super(SyscallDebugger, self).quit()
 
     def add_event(self, event):
         self.events.append(event)
 
+    def _waitpid(self, wanted_pid, blocking=True):
+        if wanted_pid in self.pending:
+            pid, status = wanted_pid, self.pending.pop(wanted_pid)
+        else:
+            pid, status = super(SyscallDebugger, self)._waitpid(wanted_pid, blocking)
+        if pid:
+            self.stops += 1
+        return pid, status
+
+    def _wait_event_pid(self, wanted_pid, blocking=True):
+        try:
+            pid, status = self._waitpid(wanted_pid, blocking)
+        except OSError as error:
+            if error.errno != errno.ECHILD:
+                raise
+            return self.dict[wanted_pid].processTerminated()
+        if not pid:
+            return None
+        return self._process_status(self.dict[pid], status)
+
+    def _process_status(self, process, status):
+        if os.WIFSTOPPED(status) and status >> 8 == signal.SIGTRAP | PTRACE_EVENT_SECCOMP << 8:
+            process.is_stopped = True
+            return SeccompStop(process)
+        return process.processStatus(status)
+
     def _wait_event(self, wanted_pid, blocking=True):
         if wanted_pid is not None:
             return self._wait_event_pid(wanted_pid, blocking)
+        if not hasattr(signal, 'sigtimedwait'):
+            return self._wait_event_polling(blocking)
+
+        while True:
+            try:
+                pid, status = self._waitpid_any(blocking)
+            except OSError as error:
+                if error.errno != errno.ECHILD or not self.dict:
+                    raise
+                return next(iter(self.dict.values())).processTerminated()
+            if not pid:
+                return None
+            process = self.dict.get(pid)
+            if process is None:
+                self.pending[pid] = status
+                continue
+            self.stops += 1
+            return self._process_status(process, status)
+
+    def _waitpid_any(self, blocking):
+        pid, status = os.waitpid(-1, os.WNOHANG | WALL)
+        if pid or not blocking:
+            return pid, status
+
+        # Sleep until a child changes state or the deadline passes. SIGCHLD
+        # is blocked before the second check so that it stays pending when
+        # it arrives in between and wakes sigtimedwait() immediately.
+        mask = signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGCHLD])
+        try:
+            while True:
+                pid, status = os.waitpid(-1, os.WNOHANG | WALL)
+                if pid:
+                    return pid, status
+                if self.deadline is None:
+                    signal.sigwaitinfo([signal.SIGCHLD])
+                    continue
+                timeout = self.deadline - clock.monotonic()
+                if timeout <= 0:
+                    raise Timeout()
+                signal.sigtimedwait([signal.SIGCHLD], timeout)
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, mask)
 
+    # Fallback for Python versions without sigtimedwait().
+    def _wait_event_polling(self, blocking):
         pause = 0.001
         while True:
             for pid in tuple(self.dict):
@@ -217,7 +803,7 @@ class SyscallDebugger(ptrace.debugger.PtraceDebugger):
                 return None
             pause = min(pause * 2, 0.5)
             if self.deadline is not None:
-                shift = self.deadline - time.time()
+                shift = self.deadline - clock.monotonic()
                 if shift > 0:
                     pause = min(pause, shift)
                 else:
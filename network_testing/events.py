@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""Records of traced syscalls and process exits.
+
+The records don't depend on ptrace so that recorded event streams can be
+saved and loaded again for offline analysis.
+"""
+import select
+import socket
+import struct
+
+import logging
+log = logging.getLogger()
+
+FAMILY_NAMES = {socket.AF_UNIX: 'AF_UNIX', socket.AF_INET: 'AF_INET', socket.AF_INET6: 'AF_INET6'}
+SOCKADDR_TYPE = 'struct sockaddr *'
+POLL_FLAGS = [(select.POLLIN, 'POLLIN'), (select.POLLPRI, 'POLLPRI'), (select.POLLOUT, 'POLLOUT'),
+              (select.POLLERR, 'POLLERR'), (select.POLLHUP, 'POLLHUP')]
+# Size of the largest socket address decoded, struct sockaddr_in6.
+SOCKADDR_SIZE = 28
+
+
+def task_str(event):
+    """Process id of an event, followed by the thread id for other than main threads."""
+    if event.tid == event.pid:
+        return str(event.pid)
+    return "{}/{}".format(event.pid, event.tid)
+
+
+class Socket:
+    connection_attempted = False
+    # A nonblocking connect is in progress.
+    connecting = False
+    # Bytes and calls in each direction, counted from syscall results.
+    sent = received = 0
+    sends = receives = 0
+    # Times of transfers in nanoseconds like Event.entered and Event.exited.
+    first_sent = last_sent = first_received = last_received = None
+    # Open descriptors of all traced processes and the time the last one
+    # was closed.
+    references = 0
+    released = None
+
+    def __init__(self, fd, domain, socktype, protocol):
+        self.events = []
+        self.fd = fd
+        self.domain = domain
+        self.socktype = socktype
+        self.protocol = protocol
+
+        log.debug(self)
+
+    def __str__(self):
+        return "Socket({fd}/{domain.text}/{socktype.text}/{protocol.text})".format(**vars(self))
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def transfer(self, sent, size, time):
+        """Account a successful send or receive of size bytes."""
+        if sent:
+            self.sent += size
+            self.sends += 1
+            if size:
+                if self.first_sent is None:
+                    self.first_sent = time
+                self.last_sent = time
+        else:
+            self.received += size
+            self.receives += 1
+            if size:
+                if self.first_received is None:
+                    self.first_received = time
+                self.last_received = time
+
+    def to_dict(self):
+        result = {
+            'fd': self.fd,
+            'domain': self.domain.to_list(),
+            'socktype': self.socktype.to_list(),
+            'protocol': self.protocol.to_list(),
+            'released': self.released,
+        }
+        if self.sends or self.receives:
+            result['traffic'] = [self.sent, self.received, self.sends, self.receives,
+                                 self.first_sent, self.last_sent, self.first_received, self.last_received]
+        return result
+
+    @classmethod
+    def from_dict(cls, data):
+        sock = cls(data['fd'], Argument(*data['domain']), Argument(*data['socktype']), Argument(*data['protocol']))
+        sock.released = data.get('released')
+        if 'traffic' in data:
+            (sock.sent, sock.received, sock.sends, sock.receives,
+             sock.first_sent, sock.last_sent, sock.first_received, sock.last_received) = data['traffic']
+        return sock
+
+
+class Argument(object):
+    __slots__ = ('value', 'text')
+
+    def __init__(self, value, text):
+        self.value = value
+        self.text = text
+
+    def __repr__(self):
+        return repr(self.text)
+
+    def to_list(self):
+        return [self.value, self.text]
+
+
+class Address(object):
+    """Decoded socket address of a syscall argument."""
+    __slots__ = ('family', 'address', 'port', 'scope')
+
+    def __init__(self, family, address=None, port=None, scope=None):
+        self.family = family
+        self.address = address
+        self.port = port
+        self.scope = scope
+
+    def __str__(self):
+        family = FAMILY_NAMES.get(self.family, str(self.family))
+        if self.family == socket.AF_INET:
+            return "<{} {}:{}>".format(family, self.address, self.port)
+        if self.family == socket.AF_INET6:
+            scope = "%{}".format(self.scope) if self.scope else ""
+            return "<{} [{}{}]:{}>".format(family, self.address, scope, self.port)
+        return "<{}>".format(family)
+
+    def __repr__(self):
+        return repr(str(self))
+
+    @classmethod
+    def unpack(cls, data):
+        """Decode a raw struct sockaddr, return None when it is truncated."""
+        if len(data) < 2:
+            return None
+        family, = struct.unpack_from('=H', data)
+        if family == socket.AF_INET:
+            if len(data) < 8:
+                return None
+            port, = struct.unpack_from('!H', data, 2)
+            return cls(family, socket.inet_ntop(family, data[4:8]), port, 0)
+        if family == socket.AF_INET6:
+            if len(data) < 28:
+                return None
+            port, = struct.unpack_from('!H', data, 2)
+            scope, = struct.unpack_from('=I', data, 24)
+            return cls(family, socket.inet_ntop(family, data[8:24]), port, scope)
+        return cls(family)
+
+    def to_list(self):
+        return [self.family, self.address, self.port, self.scope]
+
+
+class Event(object):
+    """Compact record of a traced syscall.
+
+    Only the decoded fields are kept, not the ptrace process and syscall
+    objects. Argument texts are decoded when the event is recorded as
+    pointer arguments can only be read while the tracee is stopped, only
+    the joined report line is built when needed.
+    """
+    __slots__ = ('origin', 'pid', 'tid', 'name', 'result', 'arguments', 'address', 'entered', 'exited', 'socket',
+                 '_string')
+
+    def __init__(self, syscall, entered, exited, address=None):
+        self.origin = syscall.process.origin
+        # Process and thread that made the syscall.
+        self.pid = syscall.process.tgid
+        self.tid = syscall.process.pid
+        self.name = syscall.name
+        self.result = syscall.result
+        # Argument texts are decoded right away, pointer arguments can only be
+        # read while the tracee is stopped. The socket address is already
+        # decoded by the tracer.
+        self.arguments = tuple(Argument(arg.value, str(address) if address and arg.type == SOCKADDR_TYPE else arg.getText())
+                               for arg in syscall.arguments)
+        self.address = address
+        # Monotonic nanoseconds since the tracer started, entry may be unknown.
+        self.entered = entered
+        self.exited = exited
+        self.socket = None
+        self._string = None
+
+    def __str__(self):
+        if self._string is None:
+            texts = [arg.text for arg in self.arguments]
+            while texts and not texts[-1]:
+                texts.pop()
+            self._string = "[{0.time:.3f} {0.origin} {1}] {0.name}({2}) = {0.result}".format(
+                self, task_str(self), ", ".join(texts))
+            if self.entered is not None:
+                self._string += " <{:.6f}>".format(self.duration)
+        return self._string
+
+    @property
+    def time(self):
+        """Exit time in seconds."""
+        return self.exited / 1e9
+
+    @property
+    def duration(self):
+        """Time spent in the syscall in seconds."""
+        if self.entered is None:
+            return None
+        return (self.exited - self.entered) / 1e9
+
+    def to_dict(self, sockets):
+        return {
+            'origin': self.origin,
+            'pid': self.pid,
+            'tid': self.tid,
+            'name': self.name,
+            'result': self.result,
+            'arguments': [arg.to_list() for arg in self.arguments],
+            'address': self.address.to_list() if self.address else None,
+            'entered': self.entered,
+            'exited': self.exited,
+            'socket': sockets.get(self.socket),
+        }
+
+    @classmethod
+    def from_dict(cls, data, sockets):
+        event = cls.__new__(cls)
+        event.origin = data['origin']
+        event.pid = data['pid']
+        event.tid = data.get('tid', event.pid)
+        event.name = data['name']
+        event.result = data['result']
+        event.arguments = tuple(Argument(*arg) for arg in data['arguments'])
+        event.address = Address(*data['address']) if data.get('address') else None
+        if 'exited' in data:
+            event.entered = data['entered']
+            event.exited = data['exited']
+        else:
+            # Recorded before syscall entries were timed.
+            event.entered = None
+            event.exited = int(data['time'] * 1e9)
+        event.socket = None if data['socket'] is None else sockets[data['socket']]
+        event._string = None
+        return event
+
+
+class Exit(object):
+    """Record of a traced process exit."""
+    __slots__ = ('origin', 'pid', 'exitcode', 'signum', 'time')
+    name = 'exit'
+
+    def __init__(self, origin, pid, exitcode, signum, time):
+        self.origin = origin
+        self.pid = pid
+        self.exitcode = exitcode
+        self.signum = signum
+        self.time = time
+
+    def __str__(self):
+        return "[{0.time:.3f} {0.origin} {0.pid}] exit {0.exitcode}".format(self)
+
+    def to_dict(self, sockets):
+        return {
+            'origin': self.origin,
+            'pid': self.pid,
+            'name': self.name,
+            'exitcode': self.exitcode,
+            'signum': self.signum,
+            'time': self.time,
+        }
+
+    @classmethod
+    def from_dict(cls, data, sockets):
+        return cls(data['origin'], data['pid'], data['exitcode'], data['signum'], data['time'])
+
+
+class Ready(object):
+    """Record of a connecting socket reported ready by select, poll or epoll."""
+    __slots__ = ('origin', 'pid', 'tid', 'syscall', 'fd', 'flags', 'exited', 'socket')
+    name = 'ready'
+
+    def __init__(self, origin, pid, tid, syscall, fd, flags, exited, socket):
+        self.origin = origin
+        self.pid = pid
+        self.tid = tid
+        self.syscall = syscall
+        self.fd = fd
+        self.flags = flags
+        self.exited = exited
+        self.socket = socket
+
+    def __str__(self):
+        flags = "|".join(name for bit, name in POLL_FLAGS if self.flags & bit) or str(self.flags)
+        return "[{0.time:.3f} {0.origin} {1}] {0.syscall}: ready({0.fd}, {2})".format(self, task_str(self), flags)
+
+    @property
+    def time(self):
+        return self.exited / 1e9
+
+    @property
+    def duration(self):
+        return None
+
+    def to_dict(self, sockets):
+        return {
+            'origin': self.origin,
+            'pid': self.pid,
+            'tid': self.tid,
+            'name': self.name,
+            'syscall': self.syscall,
+            'fd': self.fd,
+            'flags': self.flags,
+            'exited': self.exited,
+            'socket': sockets.get(self.socket),
+        }
+
+    @classmethod
+    def from_dict(cls, data, sockets):
+        return cls(data['origin'], data['pid'], data.get('tid', data['pid']), data['syscall'], data['fd'], data['flags'], data['exited'],
+                   None if data['socket'] is None else sockets[data['socket']])
+
+
+def dump_events(events):
+    """Convert an event stream to JSON serializable data.
+
+    Sockets are stored once and referenced from their events by index.
+    """
+    sockets = {}
+    for event in events:
+        sock = getattr(event, 'socket', None)
+        if sock is not None and sock not in sockets:
+            sockets[sock] = len(sockets)
+    return {
+        'sockets': [sock.to_dict() for sock, index in sorted(sockets.items(), key=lambda item: item[1])],
+        'events': [event.to_dict(sockets) for event in events],
+    }
+
+
+def event_records(events):
+    """Convert an event stream to a sequence of JSON serializable records.
+
+    Unlike dump_events() this works one event at a time. Each socket is
+    emitted as a record of its own right before the first event using it.
+    """
+    sockets = {}
+    for event in events:
+        sock = getattr(event, 'socket', None)
+        if sock is not None and sock not in sockets:
+            sockets[sock] = len(sockets)
+            yield dict(sock.to_dict(), record='socket', index=sockets[sock])
+        yield dict(event.to_dict(sockets), record='event')
+
+
+def load_events(data):
+    """Rebuild an event stream including the sockets' event lists."""
+    sockets = [Socket.from_dict(sock) for sock in data['sockets']]
+    events = []
+    for item in data['events']:
+        cls = {Exit.name: Exit, Ready.name: Ready}.get(item['name'], Event)
+        event = cls.from_dict(item, sockets)
+        if getattr(event, 'socket', None) is not None:
+            event.socket.events.append(event)
+        events.append(event)
+    return events
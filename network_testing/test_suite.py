@@ -2,13 +2,31 @@
 from __future__ import print_function
 
 import errno
+import glob
+import hashlib
 import json
+import math
+import multiprocessing
+import multiprocessing.util
 import os
-import re
+import select
+import shutil
+import signal
 import socket
 import subprocess
+import sys
+import time
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from . import clock
+from .database import ResultDatabase
+from .events import Exit, dump_events, event_records, load_events
 from .logger import logger
+from .topology import Topology, TopologyPool, destroy_namespaces
 
 result_str = {False: "FAIL", True: "PASS", None: "INFO"}
 
@@ -23,15 +41,38 @@ def register_property(cls):
     return cls
 
 
+def statistics(values):
+    """Summarize repeated measurements of a float property."""
+    values = sorted(values)
+    count = len(values)
+    middle = count // 2
+    median = values[middle] if count % 2 else (values[middle - 1] + values[middle]) / 2.0
+    mean = sum(values) / float(count)
+    stddev = (sum((value - mean) ** 2 for value in values) / (count - 1)) ** 0.5 if count > 1 else 0.0
+    return {
+        'count': count,
+        'min': values[0],
+        'median': median,
+        'p95': values[int(math.ceil(0.95 * count)) - 1],
+        'max': values[-1],
+        'stddev': stddev,
+    }
+
+
 class Property(object):
     description = ""
     type = "bool"
     values = None
+    # Summary of repeated runs, the value is then the median.
+    stats = None
 
     def __init__(self, value):
         self.value = value
 
     def __str__(self):
+        if self.stats:
+            return "{0.name} = {0.value} (n={1[count]}, min={1[min]:.6f}, p95={1[p95]:.6f}, max={1[max]:.6f}, " \
+                   "stddev={1[stddev]:.6f})".format(self, self.stats)
         return "{0.name} = {0.value}".format(self)
 
     def __repr__(self):
@@ -42,7 +83,10 @@ class Property(object):
         return bool(self.value)
 
     def to_dict(self):
-        return {'value': self.value, 'status': result_str[self.status]}
+        result = {'value': self.value, 'status': result_str[self.status]}
+        if self.stats:
+            result['stats'] = self.stats
+        return result
 
 @register_property
 class IP4Listener(Property):
@@ -88,6 +132,130 @@ class V6DroppedDelay(Property):
     type = "float"
 
 
+@register_property
+class ConnectLatency(Property):
+    name = 'connect-latency'
+    description = "Duration of a blocking connect."
+    short = "CL"
+    type = "float"
+    status = None
+
+
+@register_property
+class EstablishTime(Property):
+    name = 'establish-time'
+    description = "Time to establish a connection."
+    short = "TE"
+    type = "float"
+    status = None
+
+
+@register_property
+class V6RejectedFailure(Property):
+    name = 'ip6-rejected-failure'
+    description = "Time until a rejected IPv6 connection failed."
+    short = "F6R"
+    type = "float"
+    status = None
+
+
+@register_property
+class V6DroppedFailure(Property):
+    name = 'ip6-dropped-failure'
+    description = "Time until a dropped IPv6 connection failed."
+    short = "F6D"
+    type = "float"
+    status = None
+
+
+class Winner(Property):
+    type = "str"
+    status = None
+
+
+class ConnectTime(Property):
+    type = "float"
+    status = None
+
+
+@register_property
+class ImpairedWinner(Winner):
+    name = 'impaired-winner'
+    description = "Address family of the first connection established over the impaired network."
+    short = "WI"
+
+
+@register_property
+class ImpairedConnectTime(ConnectTime):
+    name = 'impaired-connect-time'
+    description = "Time to connect over the impaired network."
+    short = "CTI"
+
+
+@register_property
+class V6SlowWinner(Winner):
+    name = 'ip6-slow-winner'
+    description = "Address family of the first connection established with slow IPv6."
+    short = "W6S"
+
+
+@register_property
+class V6SlowConnectTime(ConnectTime):
+    name = 'ip6-slow-connect-time'
+    description = "Time to connect with slow IPv6."
+    short = "CT6S"
+
+
+@register_property
+class V6LossyWinner(Winner):
+    name = 'ip6-lossy-winner'
+    description = "Address family of the first connection established with lossy IPv6."
+    short = "W6L"
+
+
+@register_property
+class V6LossyConnectTime(ConnectTime):
+    name = 'ip6-lossy-connect-time'
+    description = "Time to connect with lossy IPv6."
+    short = "CT6L"
+
+
+@register_property
+class AcceptRate(Property):
+    name = 'accept-rate'
+    description = "Connections accepted per second under load."
+    short = "AR"
+    type = "float"
+    status = None
+
+
+@register_property
+class AcceptWait(Property):
+    name = 'accept-wait'
+    description = "Time the server waited in accept() for connections under load."
+    short = "AW"
+    type = "float"
+    status = None
+
+
+@register_property
+class SessionTime(Property):
+    name = 'session-time'
+    description = "Time from accepting a connection to closing it under load."
+    short = "ST"
+    type = "float"
+    status = None
+
+
+@register_property
+class LoadErrors(Property):
+    name = 'load-errors'
+    description = "Number of failed accepts and clients under load."
+    short = "LE"
+    type = "int"
+    status = None
+
+
 @register_property
 class ConnectionCleanup(Property):
     name = 'connection-cleanup'
@@ -127,44 +295,77 @@ class Errors(Property):
 class Scenario(object):
     client = server = None
     descriptoin = ''
+    # Whether the scenario runs when no scenarios are selected.
+    default = True
+    # Index of a repeated run of the scenario.
+    run_index = 0
+    server_timeout = 35
+    # Time without new socket activity after which the server is considered
+    # ready, unless the testcase declares the number of its sockets.
+    ready_quiescence = 0.2
 
     def __init__(self, testcase):
         self.expected_exitcodes = {'server': 0, 'client': 0}
-        self.namespaces = []
+        self.topology = Topology()
         self.testcase = testcase
         self.errors = []
         self.listeners = []
         self.connections = []
+        self.tracer = {}
+        self.setup_time = None
+        self.ready_time = None
+        self.ready_saved = None
+        self.decided_time = None
+        # Time taken by all runs of the scenario.
+        self.run_duration = None
+        self.events = []
+        self.pids = {}
 
     def __str__(self):
         return self.name
 
     def run(self):
+        if self.testcase.replay:
+            self.load(self.recording_path(self.testcase.replay))
+        else:
+            self.trace()
+            if self.testcase.record:
+                self.save_recording(self.recording_path(self.testcase.record))
+        self.analyze()
+
+    def trace(self):
         # this import is here to be able to run the client_server.py to anything except running tests also without
         # installed dependencies. To generate SRPM one has to run the client_server.py and it tracebacks without ptrace
         from . import debug
-        import ptrace.debugger
 
-        debugger = debug.SyscallDebugger()
+        started = clock.monotonic()
+        self.prepare()
+        try:
+            if self.testcase.pool is not None:
+                self.topology = self.testcase.pool.create(type(self), self.topology)
+            else:
+                self.topology.create()
+        except (subprocess.CalledProcessError, OSError) as error:
+            # E.g. netem parameters rejected by tc only fail the scenario.
+            self.error("Network setup failed: {}".format(error))
+            return
+        self.setup_time = clock.monotonic() - started
+        logger.debug("Scenario setup took {:.3f} s.".format(self.setup_time))
 
         # Run entities and collect syscalls.
-        self.prepare()
+        debugger = debug.SyscallDebugger(seccomp=self.testcase.seccomp,
+                                           count_read_write=self.testcase.count_read_write)
         try:
             logger.info("\n*** {} / {} ***\n".format(self.testcase.name, self.name))
 
             try:
                 self.server = self.start(debugger, "server")
-                debugger.set_timeout(35)
-                debugger.wait(self.server, "listen")
-                debugger.set_timeout(5)
-                debugger.wait(self.server, "listen")
+                self.wait_ready(debugger)
             except debug.Timeout:
                 self.error("Server timeout occured.")
 
             try:
-                self.client = self.start(debugger, "client")
-                debugger.set_timeout(20)
-                debugger.wait(self.client)
+                self.run_clients(debugger)
             except debug.Timeout:
                 self.error("Client timeout occured.")
         except BaseException as error:
@@ -175,38 +376,90 @@ class Scenario(object):
             self.cleanup()
 
         self.events = debugger.events
+        self.pids = {origin: process.pid for origin, process in (('server', self.server), ('client', self.client)) if process}
+        self.tracer = {'mode': debugger.mode, 'stops': debugger.stops}
+        logger.debug("Tracer stopped {stops} times in {mode} mode.".format(**self.tracer))
         del debugger
 
+    def recording_path(self, directory):
+        if self.run_index:
+            return os.path.join(directory, self.testcase.name, '{}-{}.json'.format(self.name, self.run_index + 1))
+        return os.path.join(directory, self.testcase.name, '{}.json'.format(self.name))
+
+    def save_recording(self, path):
+        """Save the event stream and tracing results for later replay."""
+        data = dump_events(self.events)
+        data.update(self.recording())
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as stream:
+            json.dump(data, stream, sort_keys=True)
+
+    def recording(self):
+        return {
+            'testcase': self.testcase.name,
+            'scenario': self.name,
+            'pids': self.pids,
+            'errors': self.errors,
+            'tracer': self.tracer,
+            'setup-time': self.setup_time,
+            'ready': self.ready_time,
+            'decided': self.decided_time,
+        }
+
+    def load(self, path):
+        """Load a recorded event stream instead of tracing the scenario."""
+        with open(path) as stream:
+            data = json.load(stream)
+        self.restore(data)
+
+    def restore(self, data):
+        self.events = load_events(data)
+        self.pids = data['pids']
+        self.errors = data['errors']
+        self.tracer = data['tracer']
+        self.setup_time = data['setup-time']
+        self.ready_time = data['ready']
+        self.decided_time = data['decided']
+
+    def analyze(self):
         # Process collected events.
+        listened = []
         for event in self.events:
-            if isinstance(event, ptrace.debugger.process_event.ProcessExit):
+            if isinstance(event, Exit):
                 if event.exitcode != self.expected_exitcodes[event.origin]:
                     self.error("Unexpected {} exit code {}.".format(event.origin, event.exitcode))
-                if event.process == self.server:
+                if event.pid == self.pids.get('server'):
                     logger.debug("Server exit code is {}.".format(event.exitcode))
-                if event.process == self.client:
+                if event.pid == self.pids.get('client'):
                     logger.debug("Client exit code is {}.".format(event.exitcode))
             elif event.name == 'listen':
                 if event.origin != 'server':
                     continue
                 logger.info("Server starts listening on family {} socktype {}.".format(event.socket.domain, event.socket.socktype))
                 self.listeners.append(event.socket)
+                listened.append(event.time)
             elif event.name == 'connect':
-                if event.origin != 'client':
-                    continue
-                if event.socket.domain.value not in (socket.AF_INET, socket.AF_INET6):
-                    continue
-                if event.socket.socktype.value not in [listener.socktype.value for listener in self.listeners]:
-                    continue
-                if re.search(" sin6?_port=0, ", event.arguments[1].text):
+                if not self._is_connection(event, [listener.socktype.value for listener in self.listeners]):
                     continue
                 conn = event.socket
                 conn.attempted = event.time
                 conn.status = event.result
-                conn.nonblocking = conn.status == errno.EINPROGRESS
+                # Syscall results carry negative error numbers.
+                conn.nonblocking = conn.status == -errno.EINPROGRESS
+                # Time spent in a blocking connect() waiting for the handshake.
+                conn.latency = None if conn.nonblocking else event.duration
+                conn.started = event.time - (event.duration or 0)
                 conn.shutdown = False
                 conn.closed = None
+                conn.ready = None
+                conn.ready_flags = 0
                 self.connections.append(conn)
+            elif event.name == 'ready':
+                # First readiness of a nonblocking connect reported by poll and friends.
+                if event.socket in self.connections and event.socket.ready is None:
+                    event.socket.ready = event.time
+                    event.socket.ready_flags = event.flags
             elif event.name == 'getsockopt':
                 if event.origin != 'client':
                     continue
@@ -221,9 +474,170 @@ class Scenario(object):
             elif event.name == 'close' and event.result == 0:
                 event.socket.closed = event.time
 
+        for conn in self.connections:
+            self._connection_result(conn)
+
+        # Compare with the former fixed wait for a first listen and then up
+        # to five seconds for a second one. The quiet period after the last
+        # socket makes the detection slower than the fixed wait at times.
+        if self.ready_time is not None and listened:
+            fixed = listened[0] + 5
+            if len(listened) > 1:
+                fixed = min(fixed, listened[1])
+            self.ready_saved = max(fixed - self.ready_time, 0.0)
+
         # Postprocess acquired data.
         self.postprocess()
 
+    @staticmethod
+    def _connection_result(conn):
+        """Compute the time it took to establish a connection or to fail."""
+        conn.established = conn.failed = None
+        conn.done = conn.ready if conn.nonblocking else conn.attempted
+        if conn.nonblocking:
+            if conn.ready is None:
+                return
+            elapsed = conn.ready - conn.attempted
+            # SO_ERROR is authoritative when the client has read it.
+            if conn.status == -errno.EINPROGRESS:
+                failed = conn.ready_flags & (select.POLLERR | select.POLLHUP)
+            else:
+                failed = conn.status != 0
+        else:
+            elapsed = conn.latency
+            failed = conn.status != 0
+        if elapsed is None:
+            return
+        if failed:
+            conn.failed = elapsed
+        else:
+            conn.established = elapsed
+
+    def wait_ready(self, debugger):
+        """Wait until the server is ready to serve clients.
+
+        The server is ready when it listens on a stream socket or has bound
+        a datagram socket and all of its other bound stream sockets listen
+        too. Servers often set up one socket after another, so the set is
+        only considered complete after a short quiet period, unless both
+        address families are already served or the testcase declares how
+        many sockets to expect in its 'ready' file.
+        """
+        from . import debug
+
+        deadline = clock.monotonic() + self.server_timeout
+        bound = set()
+        ready = set()
+        quiescent = False
+
+        debugger.set_timeout(self.server_timeout)
+        while True:
+            try:
+                event = debugger.wait(self.server, ('bind', 'listen'))
+            except debug.Timeout:
+                if quiescent:
+                    break
+                raise
+            # The server has exited, a daemonizing server goes on setting up
+            # its sockets in a child process.
+            if not isinstance(event, debug.Event):
+                if not any(process.origin == 'server' for process in debugger.dict.values()):
+                    return
+                continue
+
+            sock = event.socket
+            if sock and event.result == 0 and sock.domain.value in (socket.AF_INET, socket.AF_INET6):
+                if event.name == 'listen' or sock.socktype.value & 0xf == socket.SOCK_DGRAM:
+                    ready.add(sock)
+                if event.name == 'bind':
+                    bound.add(sock)
+
+            if self.testcase.ready is not None:
+                if len(ready) >= self.testcase.ready:
+                    break
+                continue
+            quiescent = bool(ready) and not bound - ready
+            # Serving both address families is as complete as it gets.
+            if quiescent and len(set(sock.domain.value for sock in ready)) == 2:
+                break
+            if quiescent:
+                debugger.set_timeout(min(self.ready_quiescence, deadline - clock.monotonic()))
+            else:
+                debugger.set_timeout(deadline - clock.monotonic())
+
+        self.ready_time = debugger.elapsed()
+        logger.debug("Server ready after {:.3f} s.".format(self.ready_time))
+
+    def run_clients(self, debugger):
+        self.client = self.start(debugger, "client")
+        debugger.set_timeout(20)
+        self.wait_client(debugger)
+
+    def wait_client(self, debugger):
+        """Wait for the client to exit or the scenario to be decided.
+
+        With early exit enabled, the client is only followed until its
+        connection attempts are conclusive for the scenario's properties.
+        It is then killed along with the server and its exit code is not
+        checked.
+        """
+        from . import debug
+
+        if not self.testcase.early_exit:
+            debugger.wait(self.client)
+            return
+        # Server socket types, attempted connections and whether they were
+        # closed are followed as new events come in.
+        self.socktypes = set()
+        self.attempts = {}
+        self.unclosed = 0
+        seen = 0
+        while True:
+            event = debugger.wait(self.client, ('connect', 'close'))
+            # The client has exited.
+            if not isinstance(event, debug.Event):
+                return
+            self._track_connections(debugger.events[seen:])
+            seen = len(debugger.events)
+            if self.decided():
+                self.decided_time = debugger.elapsed()
+                logger.debug("Scenario decided after {:.3f} s.".format(self.decided_time))
+                return
+
+    def decided(self):
+        """Return True when no further client activity can change the properties."""
+        return False
+
+    def _is_connection(self, event, socktypes):
+        """Whether a connect event is an attempt to reach the server."""
+        if event.origin != 'client':
+            return False
+        if event.socket.domain.value not in (socket.AF_INET, socket.AF_INET6):
+            return False
+        if event.socket.socktype.value not in socktypes:
+            return False
+        # Skip address sorting probes of getaddrinfo().
+        if event.address and event.address.port == 0:
+            return False
+        return True
+
+    def _track_connections(self, events):
+        """Follow attempted connections and their closing through new events."""
+        for event in events:
+            name = getattr(event, 'name', None)
+            if name == 'listen' and event.origin == 'server':
+                self.socktypes.add(event.socket.socktype.value)
+            elif name == 'connect' and event.socket not in self.attempts and self._is_connection(event, self.socktypes):
+                self.attempts[event.socket] = False
+                self.unclosed += 1
+            elif name == 'close' and event.result == 0 and self.attempts.get(event.socket) is False:
+                self.attempts[event.socket] = True
+                self.unclosed -= 1
+
+    def _closed_connections(self):
+        """Return the families of attempted connections and whether all were closed."""
+        return sorted(sock.domain.value for sock in self.attempts), not self.unclosed
+
     def start(self, debugger, origin):
         import ptrace.debugger
 
@@ -240,33 +654,49 @@ class Scenario(object):
         os.environ['NETRESOLVE_SYSCONFDIR'] = data_path;
         os.environ['DEFAULT_SERVICE'] = 'http'
 
-    def delns_if_exists(self, ns):
-        if os.path.exists("/var/run/netns/%s" %(ns)):
-            subprocess.call(['ip', 'netns', 'delete', ns])
-        if ns in self.namespaces:
-            self.namespaces.remove(ns)
-
     def cleanup(self):
-        for ns in self.namespaces:
-            self.delns_if_exists(ns)
+        # Pooled topologies are reset when reused and destroyed with the pool.
+        if self.testcase.pool is None:
+            self.topology.destroy()
 
     def postprocess(self):
         pass
 
+    def _netns(self, name):
+        return '{}-{}-{}'.format(self.testcase.prefix, self.name, name)
+
     def _add_netns(self, ns):
-        self.delns_if_exists(ns)
-        self.namespaces.append(ns)
-        subprocess.check_call(['ip', 'netns', 'add', ns])
-        subprocess.check_call(['ip', '-n', ns, 'link', 'set', 'lo', 'up'])
+        self.topology.add_netns(ns)
 
-    def _add_veth(self, ns1, ns2):
-        link1, link2 = ns1, ns2
-        subprocess.check_call(['ip', 'link', 'add', 'dev', link1, 'type', 'veth', 'peer', 'name', link2])
-        for ns, link in (ns1, link1), (ns2, link2):
-            subprocess.check_call(['ip', 'link', 'set', link, 'netns', ns, 'up'])
+    def _add_veth(self, ns1, link1, ns2, link2):
+        # Create the pair directly in the namespaces so that link names only
+        # need to be unique there and concurrent runs don't clash.
+        self.topology.add_veth(ns1, link1, ns2, link2)
 
     def _add_address(self, ns, link, address):
-        subprocess.check_call(['ip', '-n', ns, 'address', 'add', address, 'dev', link])
+        self.topology.add_address(ns, link, address)
+
+    def _add_rule(self, ns, command):
+        self.topology.add_rule(ns, command)
+
+    def _add_netem(self, ns, link, impairments):
+        """Impair outgoing traffic of a link per address family.
+
+        Impairments map 'ip4' and 'ip6' to netem parameters. Traffic of each
+        family is classified into its own band of a prio qdisc.
+        """
+        if not impairments:
+            return
+        self._add_rule(ns, ['tc', 'qdisc', 'add', 'dev', link, 'root', 'handle', '1:', 'prio', 'bands', '3',
+                            'priomap'] + ['0'] * 16)
+        # Filters of different protocols can't share a priority.
+        for band, (family, protocol) in enumerate((('ip4', 'ip'), ('ip6', 'ipv6')), 2):
+            params = impairments.get(family)
+            if not params:
+                continue
+            self._add_rule(ns, ['tc', 'qdisc', 'add', 'dev', link, 'parent', '1:{}'.format(band), 'netem'] + params.split())
+            self._add_rule(ns, ['tc', 'filter', 'add', 'dev', link, 'parent', '1:', 'protocol', protocol,
+                                'prio', str(band - 1), 'u32', 'match', 'u32', '0', '0', 'flowid', '1:{}'.format(band)])
 
     def error(self, error):
         self.errors.append(error)
@@ -283,9 +713,15 @@ class Scenario(object):
                 print("        {}".format(event))
         for error in self.errors:
             print('      ' + str(error))
+        if self.tracer:
+            print("      Tracer stops: {stops} ({mode})".format(**self.tracer))
+        if self.ready_saved is not None:
+            print("      Server ready after {:.3f} s, {:.3f} s saved".format(self.ready_time, self.ready_saved))
+        if self.decided_time is not None:
+            print("      Decided after {:.3f} s, client terminated early".format(self.decided_time))
 
     def event_to_dict(self, event):
-        return {'str': str(event)}
+        return {'str': str(event), 'duration': event.duration}
 
     def err_to_dict(self, error):
         return {'str': str(error)}
@@ -293,6 +729,23 @@ class Scenario(object):
     def sock_to_dict(self, sock):
         result = {}
         result['events'] = [self.event_to_dict(event) for event in sock.events]
+        result['established'] = getattr(sock, 'established', None)
+        result['failed'] = getattr(sock, 'failed', None)
+        result['traffic'] = self.traffic_to_dict(sock)
+        # The last descriptor of the socket was closed.
+        result['released'] = sock.released / 1e9 if sock.released is not None else None
+        return result
+
+    def traffic_to_dict(self, sock):
+        """Data carried by a socket, times are relative to its connect or accept."""
+        result = {'sent': sock.sent, 'received': sock.received, 'sends': sock.sends, 'receives': sock.receives}
+        started = [event.exited for event in sock.events if event.name in ('connect', 'accept', 'accept4')]
+        if not started and sock.events:
+            started = [sock.events[0].exited]
+        last = [time for time in (sock.last_sent, sock.last_received) if time is not None]
+        result['first-byte'] = (sock.first_received - started[0]) / 1e9 \
+            if started and sock.first_received is not None else None
+        result['last-byte'] = (max(last) - started[0]) / 1e9 if started and last else None
         return result
 
     def to_dict(self):
@@ -300,6 +753,11 @@ class Scenario(object):
         result['listeners'] = [self.sock_to_dict(listener) for listener in self.listeners]
         result['connections'] = [self.sock_to_dict(connection) for connection in self.connections]
         result['errors'] = [self.err_to_dict(error) for error in self.errors]
+        result['tracer'] = self.tracer
+        result['setup-time'] = self.setup_time
+        result['readiness'] = {'ready': self.ready_time, 'saved': self.ready_saved}
+        result['decided'] = self.decided_time
+        result['duration'] = self.run_duration
         return result
 
 
@@ -310,36 +768,43 @@ class LoopbackScenario(Scenario):
     def prepare(self):
         super(self.__class__, self).prepare()
         os.environ['SOURCE'] = os.environ['DESTINATION'] = 'localhost'
-        self._add_netns('test-loopback')
+        self._add_netns(self._netns('host'))
 
     def command(self, name, origin):
-        return ['ip', 'netns', 'exec', 'test-loopback', 'wrapresolve', os.path.join(testcase_path, name, origin)]
+        return ['ip', 'netns', 'exec', self._netns('host'), 'wrapresolve', os.path.join(testcase_path, name, origin)]
 
 
 class DualstackScenario(Scenario):
     name = 'dualstack'
     description = "Hosts connected via IPv4 and IPv6."
 
-    source_ns = 'test-client'
-    destination_ns = 'test-server'
-    source_link, destination_link = source_ns, destination_ns
+    source_link = 'test-client'
+    destination_link = 'test-server'
     destination_config = ['192.0.2.1/24', '2001:DB8::2:1/64']
     source_config = ['192.0.2.2/24', '2001:DB8::2:2/64']
 
+    @property
+    def source_ns(self):
+        return self._netns('client')
+
+    @property
+    def destination_ns(self):
+        return self._netns('server')
+
     def prepare(self):
         super(DualstackScenario, self).prepare()
         os.environ['SOURCE'] = 'client.example.net'
         os.environ['DESTINATION'] = 'server.example.net'
         for ns in self.source_ns, self.destination_ns:
             self._add_netns(ns)
-        self._add_veth(self.source_ns, self.destination_ns)
+        self._add_veth(self.source_ns, self.source_link, self.destination_ns, self.destination_link)
         for address in self.source_config:
             self._add_address(self.source_ns, self.source_link, address)
         for address in self.destination_config:
             self._add_address(self.destination_ns, self.destination_link, address)
 
     def command(self, name, origin):
-        return ['ip', 'netns', 'exec', 'test-{}'.format(origin), 'wrapresolve',
+        return ['ip', 'netns', 'exec', self._netns(origin), 'wrapresolve',
                 os.path.join(testcase_path, name, origin)]
 
     def postprocess(self):
@@ -348,6 +813,10 @@ class DualstackScenario(Scenario):
         self.testcase.add_property(
             IP6Listener(bool([listener for listener in self.listeners if listener.domain.value == socket.AF_INET6])))
         self.testcase.add_property(ParallelConnect(len(self.connections) > 1))
+        blocking = [conn for conn in self.connections if conn.latency is not None]
+        self.testcase.add_property(ConnectLatency(blocking[0].latency if blocking else None))
+        established = [conn for conn in self.connections if conn.established is not None]
+        self.testcase.add_property(EstablishTime(established[0].established if established else None))
 
     @staticmethod
     def _check_preferred(preferred, fallback):
@@ -392,8 +861,13 @@ class IP6RejectedScenario(DualstackScenario):
         #
         # https://bugzilla.redhat.com/show_bug.cgi?id=1336496
         #
-        #subprocess.check_call(['ip', 'netns', 'exec', 'test-client', 'ip6tables', '-A', 'OUTPUT', '-j', 'REJECT'])
-        subprocess.check_call(['ip', 'netns', 'exec', 'test-client', 'ip6tables', '-A', 'OUTPUT', '-j', 'REJECT'])
+        #self._add_rule(self.source_ns, ['ip6tables', '-A', 'OUTPUT', '-j', 'REJECT'])
+        self._add_rule(self.source_ns, ['ip6tables', '-A', 'OUTPUT', '-j', 'REJECT'])
+
+    def decided(self):
+        # One attempt per family, both closed, as the properties require.
+        families, closed = self._closed_connections()
+        return families == [socket.AF_INET, socket.AF_INET6] and closed
 
     def postprocess(self):
         v4 = [conn for conn in self.connections if conn.domain.value == socket.AF_INET]
@@ -406,6 +880,8 @@ class IP6RejectedScenario(DualstackScenario):
             v6preferred = self._check_preferred(v6[0], v4[0])
             self.testcase.add_property(V6RejectedDelay(v6preferred))
             self.testcase.add_property(ConnectionCleanup(bool(v6preferred and v4[0].shutdown and v4[0].closed)))
+        if len(v6) == 1:
+            self.testcase.add_property(V6RejectedFailure(v6[0].failed))
 
 
 class IP6DroppedScenario(DualstackScenario):
@@ -414,7 +890,11 @@ class IP6DroppedScenario(DualstackScenario):
 
     def prepare(self):
         super(IP6DroppedScenario, self).prepare()
-        subprocess.check_call(['ip', 'netns', 'exec', 'test-client', 'ip6tables', '-A', 'OUTPUT', '-j', 'DROP'])
+        self._add_rule(self.source_ns, ['ip6tables', '-A', 'OUTPUT', '-j', 'DROP'])
+
+    def decided(self):
+        families, closed = self._closed_connections()
+        return families == [socket.AF_INET, socket.AF_INET6] and closed
 
     def postprocess(self):
         v4 = [conn for conn in self.connections if conn.domain.value == socket.AF_INET]
@@ -425,28 +905,306 @@ class IP6DroppedScenario(DualstackScenario):
             v6preferred = self._check_preferred(v6[0], v4[0])
 
         self.testcase.add_property(V6DroppedDelay(v6preferred))
+        if len(v6) == 1:
+            self.testcase.add_property(V6DroppedFailure(v6[0].failed))
+
+
+class ImpairedScenario(DualstackScenario):
+    name = 'impaired'
+    description = "Hosts connected via IPv4 and IPv6 impaired as given on the command line."
+    winner_property = ImpairedWinner
+    connect_time_property = ImpairedConnectTime
+
+    @property
+    def default(self):
+        # Without netem parameters the scenario is the same as dualstack.
+        return bool(self.testcase.netem)
+
+    @property
+    def impairments(self):
+        return self.testcase.netem or {}
+
+    def prepare(self):
+        super(ImpairedScenario, self).prepare()
+        # Delaying the client's packets delays the whole round trip.
+        self._add_netem(self.source_ns, self.source_link, self.impairments)
+
+    def postprocess(self):
+        established = sorted((conn for conn in self.connections if conn.established is not None),
+                             key=lambda conn: conn.done)
+        winner = connect_time = None
+        if established:
+            winner = {socket.AF_INET: 'IPv4', socket.AF_INET6: 'IPv6'}[established[0].domain.value]
+            connect_time = established[0].done - min(conn.started for conn in self.connections)
+        self.testcase.add_property(self.winner_property(winner))
+        self.testcase.add_property(self.connect_time_property(connect_time))
+
+
+class IP6SlowScenario(ImpairedScenario):
+    name = 'v6slow'
+    description = "Hosts connected via IPv4 and IPv6 with 300 ms of additional delay."
+    default = False
+    winner_property = V6SlowWinner
+    connect_time_property = V6SlowConnectTime
+    impairments = {'ip6': 'delay 300ms'}
+
+
+class IP6LossyScenario(ImpairedScenario):
+    name = 'v6lossy'
+    description = "Hosts connected via IPv4 and IPv6 losing half of the packets."
+    default = False
+    winner_property = V6LossyWinner
+    connect_time_property = V6LossyConnectTime
+    impairments = {'ip6': 'loss 50%'}
+
+
+class LoadScenario(DualstackScenario):
+    name = 'load'
+    description = "Hosts connected via IPv4 and IPv6 with many clients connecting to the server."
+    default = False
+    # Total number of clients, clients running at once and seconds to
+    # start new clients for. Tracing only the server keeps the overhead down.
+    clients = 100
+    concurrency = 4
+    duration = 5.0
+    server_only = False
+    client_timeout = 20
+    poll_interval = 0.01
+
+    def __init__(self, testcase):
+        super(LoadScenario, self).__init__(testcase)
+        load = testcase.load or {}
+        self.clients = load.get('clients', self.clients)
+        self.concurrency = load.get('concurrency', self.concurrency)
+        self.duration = load.get('duration', self.duration)
+        self.server_only = load.get('server_only', self.server_only)
+        self.workload = None
+
+    def run_clients(self, debugger):
+        """Keep clients running until all of them were started or the duration is over."""
+        from . import debug
+
+        command = self.command(self.testcase.name, 'client')
+        if not os.path.exists(command[-1]):
+            self.error("Script 'client' not found.")
+            return
+
+        started = debugger.elapsed()
+        # Untraced clients map to None.
+        running = {}
+        launched = failures = 0
+        checked = 0
+        try:
+            while True:
+                now = debugger.elapsed()
+                if now > started + self.duration + self.client_timeout:
+                    raise debug.Timeout()
+                serving = self.server is not None and self.server.pid in debugger.dict
+                while serving and launched < self.clients and len(running) < self.concurrency \
+                        and now < started + self.duration:
+                    if self.server_only:
+                        running[debugger.spawn(command)] = None
+                    else:
+                        process = debugger.new_child('client', command)
+                        running[process.pid] = process
+                    launched += 1
+                if not running:
+                    break
+
+                if debugger.dict:
+                    debugger.set_timeout(self.poll_interval)
+                    try:
+                        debugger.wait(self.server)
+                    except debug.Timeout:
+                        pass
+                else:
+                    # Only untraced clients are left.
+                    select.select([], [], [], self.poll_interval)
+
+                exits = {event.pid: event.exitcode for event in debugger.events[checked:] if isinstance(event, Exit)}
+                checked = len(debugger.events)
+                for pid, process in list(running.items()):
+                    if process is not None:
+                        if pid not in exits:
+                            continue
+                        exitcode = exits[pid]
+                    else:
+                        status = debugger.reap(pid)
+                        if status is None:
+                            continue
+                        exitcode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else None
+                    if exitcode != self.expected_exitcodes['client']:
+                        failures += 1
+                        # Exit codes of traced clients are checked with the rest of the events.
+                        if process is None:
+                            self.error("Unexpected client exit code {}.".format(exitcode))
+                    del running[pid]
+        finally:
+            for pid, process in running.items():
+                if process is None:
+                    os.kill(pid, signal.SIGKILL)
+                    debugger.reap(pid, blocking=True)
+            self.workload = {
+                'clients': launched,
+                'concurrency': self.concurrency,
+                'failures': failures,
+                'server-only': self.server_only,
+                'time': debugger.elapsed() - started,
+            }
+
+    def recording(self):
+        result = super(LoadScenario, self).recording()
+        result['workload'] = self.workload
+        return result
+
+    def restore(self, data):
+        super(LoadScenario, self).restore(data)
+        self.workload = data['workload']
+
+    def postprocess(self):
+        accepts = [event for event in self.events
+                   if event.origin == 'server' and event.name in ('accept', 'accept4')]
+        accepted = [event for event in accepts if event.result >= 0]
+        # Nonblocking servers accept until there are no more connections.
+        failed = [event for event in accepts if event.result < 0 and event.result != -errno.EAGAIN]
+        sessions = []
+        for event in accepted:
+            closed = [other.time for other in event.socket.events if other.name == 'close'] if event.socket else []
+            if closed:
+                sessions.append(closed[0] - event.time)
+
+        workload = self.workload or {}
+        # The server is only killed after the load, an earlier exit means
+        # the rate wasn't measured.
+        exited = [event for event in self.events if isinstance(event, Exit) and event.pid == self.pids.get('server')]
+        rate = None
+        if accepted and not exited and workload.get('time'):
+            rate = len(accepted) / workload['time']
+        self.testcase.add_property(AcceptRate(rate))
+        self.testcase.add_property(self._distribution(AcceptWait, [event.duration for event in accepted
+                                                                   if event.duration is not None]))
+        self.testcase.add_property(self._distribution(SessionTime, sessions))
+        self.testcase.add_property(LoadErrors(len(failed) + workload.get('failures', 0)))
+
+    @staticmethod
+    def _distribution(cls, values):
+        """A property with the median of the values and their statistics."""
+        prop = cls(None)
+        if values:
+            prop.stats = statistics(values)
+            prop.value = prop.stats['median']
+        return prop
+
+    def report(self):
+        super(LoadScenario, self).report()
+        if self.workload:
+            print("      Load: {clients} clients, {failures} failed, {time:.3f} s".format(**self.workload))
+
+    def to_dict(self):
+        result = super(LoadScenario, self).to_dict()
+        result['workload'] = self.workload
+        return result
 
 
 class TestCase:
-    scenario_classes = [LoopbackScenario, DualstackScenario, IP6RejectedScenario, IP6DroppedScenario]
+    scenario_classes = [LoopbackScenario, DualstackScenario, IP6RejectedScenario, IP6DroppedScenario,
+                        ImpairedScenario, IP6SlowScenario, IP6LossyScenario, LoadScenario]
 
-    def __init__(self, name, scenarios=None):
+    def __init__(self, name, scenarios=None, seccomp=True, prefix='test', pool=None, early_exit=True,
+                 record=None, replay=None, repeat=1, netem=None, load=None, outdir=None, stream_events=False,
+                 count_read_write=False):
         self.name = name
+        self.repeat = repeat
+        # Netem parameters per address family for the impaired scenario.
+        self.netem = netem
+        # Client count, concurrency, duration and tracing of the load scenario.
+        self.load = load
+        self.seccomp = seccomp
+        # Count data of read() and write() on sockets at the cost of
+        # stopping on every read and write.
+        self.count_read_write = count_read_write
+        self.early_exit = early_exit
+        # Directories to save event streams to or to load them from.
+        self.record = record
+        self.replay = replay
+        self.prefix = prefix
+        self.pool = pool
+        # Optional number of sockets the server is ready with.
+        self.ready = None
+        try:
+            with open(os.path.join(testcase_path, name, 'ready')) as ready_file:
+                self.ready = int(ready_file.read())
+        except IOError:
+            pass
         self.scenarios = [cls(self) for cls in self.scenario_classes]
         if scenarios:
             self.scenarios = [scenario for scenario in self.scenarios if scenario.name in scenarios]
+        else:
+            self.scenarios = [scenario for scenario in self.scenarios if scenario.default]
+        if replay:
+            self.scenarios = [scenario for scenario in self.scenarios
+                              if os.path.exists(scenario.recording_path(replay))]
         self.properties = {}
+        self.samples = {}
+        # Directory to write scenario results to as soon as they are available.
+        self.outdir = outdir
+        self.stream_events = stream_events
+        self.writer = None
+        self.duration = None
 
     def run(self):
+        started = clock.monotonic()
+        if self.outdir:
+            self.writer = ResultWriter(self.outdir, self.name, self.stream_events)
         errors = Errors(0)
         for scenario in self.scenarios:
-            scenario.run()
-            errors.value += len(scenario.errors)
+            scenario_started = clock.monotonic()
+            # Repeated runs only contribute errors and property samples,
+            # the details of the first run are reported.
+            first = None
+            for index in range(self.repeat):
+                if index:
+                    run = type(scenario)(self)
+                    run.run_index = index
+                else:
+                    run = scenario
+                run.run()
+                errors.value += len(run.errors)
+                if index:
+                    scenario.errors += ["Run {}: {}".format(index + 1, error) for error in run.errors]
+                    # Other properties are reported from the first run as well,
+                    # runs that disagree are errors.
+                    for cls, prop in first.items():
+                        current = self.properties[cls]
+                        if prop.type == 'float' or current is prop:
+                            continue
+                        if current.value != prop.value:
+                            scenario.error("Run {}: {} is {} instead of {}.".format(
+                                index + 1, prop.name, current.value, prop.value))
+                            errors.value += 1
+                        self.properties[cls] = prop
+                else:
+                    first = dict(self.properties)
+                if self.writer:
+                    self.writer.add_events(run)
+            scenario.run_duration = clock.monotonic() - scenario_started
+            if self.writer:
+                self.writer.add_scenario(scenario.to_dict())
+                # Only the sockets of interest are kept for the report.
+                scenario.events = []
+        if self.repeat > 1:
+            for cls, values in self.samples.items():
+                prop = self.properties[cls]
+                prop.stats = statistics(values)
+                prop.value = prop.stats['median']
         self.add_property(errors)
         self.result = len([prop for prop in self.properties.values() if prop.status is False]) == 0
+        self.duration = clock.monotonic() - started
 
     def add_property(self, prop):
         self.properties[type(prop)] = prop
+        if prop.type == 'float' and prop.value is not None:
+            self.samples.setdefault(type(prop), []).append(prop.value)
 
     def report(self):
         print(self.name)
@@ -456,31 +1214,448 @@ class TestCase:
         print("  Properties:")
         for text, status in sorted([(str(value), value.status) for value in self.properties.values()]):
             print("    {} ({})".format(text, result_str[status]))
+        saved = [scenario.ready_saved for scenario in self.scenarios if scenario.ready_saved is not None]
+        if saved:
+            print("  Readiness detection saved {:.3f} s.".format(sum(saved)))
         print("  Result: {}".format(result_str[self.result]))
         print()
 
-    def to_dict(self):
-        result = {'status': result_str[self.result]}
+    def to_dict(self, scenarios=True):
+        result = {'status': result_str[self.result], 'duration': self.duration}
         props = result['properties'] = {prop.name: prop.to_dict() for prop in self.properties.values()}
-        scenarios = result['scenarios'] = [scenario.to_dict() for scenario in self.scenarios]
+        if scenarios and self.writer:
+            result['scenarios'] = list(self.writer.scenarios())
+        elif scenarios:
+            result['scenarios'] = [scenario.to_dict() for scenario in self.scenarios]
         return result
 
     def save(self, outdir):
-        with open(os.path.join(outdir, "test-client-server-{}.json".format(self.name)), 'w') as stream:
-            json.dump({self.name: self.to_dict()}, stream,
-                      indent=4, separators=(',', ': '), sort_keys=True)
-            print(file=stream)
+        if self.writer:
+            self.writer.save(outdir, self.to_dict(scenarios=False))
+        else:
+            save_result(outdir, self.name, self.to_dict())
+
+
+class TestCaseResult:
+    """Outcome of a testcase that was run in another process."""
+
+    def __init__(self, name, result, data, output):
+        self.name = name
+        self.result = result
+        self.data = data
+        self.output = output
+
+    def to_dict(self):
+        return self.data
+
+    def report(self):
+        print(self.output, end='')
+
+    def save(self, outdir):
+        # Streamed results have been saved by the worker.
+        if self.data is not None:
+            save_result(outdir, self.name, self.data)
+
+
+def result_path(outdir, name):
+    return os.path.join(outdir, "test-client-server-{}.json".format(name))
+
+
+def save_result(outdir, name, data, scenarios=None):
+    """Save the result file of a testcase.
+
+    Scenario results can be passed as an iterable instead of being part of
+    data, they are then written one by one.
+    """
+    options = {'indent': 4, 'separators': (',', ': '), 'sort_keys': True}
+    with open(result_path(outdir, name), 'w') as stream:
+        if scenarios is None:
+            json.dump({name: data}, stream, **options)
+        else:
+            # Produce the same output as json.dump() by splicing the list
+            # into the place of a placeholder.
+            placeholder = json.dumps('\0scenarios')
+            head, tail = json.dumps({name: dict(data, scenarios='\0scenarios')}, **options).split(placeholder)
+            indent = head.rsplit('\n', 1)[1].replace('"scenarios": ', '')
+            stream.write(head + '[')
+            empty = True
+            for scenario in scenarios:
+                text = json.dumps(scenario, **options).replace('\n', '\n' + indent + '    ')
+                stream.write('{}\n{}    {}'.format('' if empty else ',', indent, text))
+                empty = False
+            stream.write(']' if empty else '\n' + indent + ']')
+            stream.write(tail)
+        print(file=stream)
+
+
+class ResultWriter(object):
+    """Write results of scenarios as soon as they complete.
+
+    Scenario results are appended to a JSON Lines file that is turned into
+    the result file at the end. Neither the results nor the event streams
+    of completed scenarios have to be kept in memory and an interrupted
+    run leaves the results of completed scenarios behind. Event streams of
+    all runs can be written to another JSON Lines file as well.
+    """
+
+    def __init__(self, outdir, name, events=False):
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        self.name = name
+        self.path = os.path.join(outdir, "test-client-server-{}.partial.jsonl".format(name))
+        self.events_path = os.path.join(outdir, "test-client-server-{}.events.jsonl".format(name)) if events else None
+        for path in self.path, self.events_path:
+            if path:
+                open(path, 'w').close()
+
+    def _append(self, path, records):
+        with open(path, 'a') as stream:
+            for record in records:
+                stream.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def add_scenario(self, data):
+        self._append(self.path, [data])
+
+    def add_events(self, scenario):
+        if self.events_path:
+            run = {'testcase': self.name, 'scenario': scenario.name, 'run': scenario.run_index + 1}
+            self._append(self.events_path, (dict(record, **run) for record in event_records(scenario.events)))
+
+    def scenarios(self):
+        with open(self.path) as stream:
+            for line in stream:
+                yield json.loads(line)
+
+    def save(self, outdir, data):
+        save_result(outdir, self.name, data, self.scenarios())
+        os.remove(self.path)
+
+
+def capture_report(testcase):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        testcase.report()
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def dependencies(name):
+    """Packages required by a testcase."""
+    try:
+        with open(os.path.join(testcase_path, name, 'deps')) as deps_file:
+            return [dependency for dependency in deps_file.read().splitlines() if dependency]
+    except IOError:
+        return []
+
+
+def package_versions(packages):
+    """Query installed versions of packages, None when rpm is not available."""
+    try:
+        process = subprocess.Popen(['rpm', '-q'] + sorted(packages), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError:
+        return None
+    return process.communicate()[0].decode('utf-8', 'replace')
+
+
+class CachedResult(TestCaseResult):
+    """Outcome of a testcase taken from the result cache."""
+
+    def __init__(self, name, result, output, path):
+        TestCaseResult.__init__(self, name, result, None, output)
+        self.path = path
+
+    def save(self, outdir):
+        shutil.copyfile(self.path, result_path(outdir, self.name))
+
+
+class ResultCache(object):
+    """Results of testcases keyed by everything they depend on.
+
+    The key covers the files of the testcase, the sources of the tracer
+    and scenario definitions, the installed versions of the packages the
+    testcase depends on and the options it is run with. Only passing
+    results are stored.
+    """
+
+    # Modules that affect results, reporting and query tools don't.
+    modules = ['clock.py', 'debug.py', 'events.py', 'test_suite.py', 'topology.py']
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.keys = {}
+
+    @staticmethod
+    def _hash_tree(digest, path):
+        for directory, dirnames, filenames in os.walk(path, followlinks=True):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                filename = os.path.join(directory, filename)
+                digest.update(os.path.relpath(filename, path).encode('utf-8') + b'\0')
+                with open(filename, 'rb') as stream:
+                    digest.update(hashlib.sha256(stream.read()).digest())
+
+    def key(self, testcase):
+        digest = hashlib.sha256()
+        self._hash_tree(digest, os.path.join(testcase_path, testcase.name))
+        for filename in self.modules:
+            with open(os.path.join(os.path.dirname(__file__), filename), 'rb') as stream:
+                digest.update(hashlib.sha256(stream.read()).digest())
+        packages = dependencies(testcase.name)
+        options = {
+            'scenarios': [scenario.name for scenario in testcase.scenarios],
+            'seccomp': testcase.seccomp,
+            'count-read-write': testcase.count_read_write,
+            'early-exit': testcase.early_exit,
+            'repeat': testcase.repeat,
+            'netem': testcase.netem,
+            'load': testcase.load,
+            'packages': package_versions(packages) if packages else None,
+        }
+        digest.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, name, key):
+        return os.path.join(self.directory, "{}-{}".format(name, key))
+
+    def lookup(self, testcase):
+        key = self.keys[testcase.name] = self.key(testcase)
+        path = self._path(testcase.name, key)
+        try:
+            with open(path + '.meta.json') as stream:
+                meta = json.load(stream)
+        except IOError:
+            return None
+        if not os.path.exists(path + '.json'):
+            return None
+        logger.info("Using cached result of {}.".format(testcase.name))
+        return CachedResult(testcase.name, meta['result'], meta['output'], path + '.json')
+
+    def store(self, testcase, outdir):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self._path(testcase.name, self.keys[testcase.name])
+        shutil.copyfile(result_path(outdir, testcase.name), path + '.json')
+        # The metadata file is written last as it marks a complete entry.
+        with open(path + '.meta.json', 'w') as stream:
+            json.dump({'result': testcase.result, 'output': capture_report(testcase)}, stream, sort_keys=True)
+
+
+def load_durations(directory, testcases):
+    """Estimate durations of testcases from an earlier output directory.
+
+    Durations of the selected scenarios are summed up when all of them are
+    known, otherwise the duration of the whole testcase is used.
+    """
+    durations = {}
+    for testcase in testcases:
+        # Files left behind by an interrupted run may be incomplete.
+        try:
+            with open(result_path(directory, testcase.name)) as stream:
+                data = json.load(stream)[testcase.name]
+        except (IOError, ValueError, KeyError):
+            continue
+        scenarios = {scenario['name']: scenario.get('duration') for scenario in data.get('scenarios', [])}
+        selected = [scenarios.get(scenario.name) for scenario in testcase.scenarios]
+        if selected and None not in selected:
+            durations[testcase.name] = sum(selected)
+        elif data.get('duration') is not None:
+            durations[testcase.name] = data['duration']
+    return durations
+
+
+def longest_first(names, durations):
+    """Order testcases by expected duration, longest first.
+
+    Testcases without a known duration are expected to take the average
+    time. Ties are broken by name. Returns names with expected durations.
+    """
+    known = [durations[name] for name in names if name in durations]
+    default = sum(known) / len(known) if known else 1.0
+    return [(name, durations.get(name, default))
+            for name in sorted(names, key=lambda name: (-durations.get(name, default), name))]
+
+
+def schedule(names, durations, count):
+    """Distribute testcases into count bins with balanced total durations.
+
+    Testcases are assigned longest first to the bin with the lowest total
+    so far, which is also what a pool of workers does with testcases
+    submitted longest first. Ties are broken by bin index so that the
+    result only depends on the arguments. Returns the bins and their
+    predicted totals.
+    """
+    bins = [[] for index in range(count)]
+    totals = [0.0] * count
+    for name, duration in longest_first(names, durations):
+        index = min(range(count), key=lambda index: (totals[index], index))
+        bins[index].append(name)
+        totals[index] += duration
+    return bins, totals
+
+
+def merge_results(directories, outdir):
+    """Combine result files of several output directories, e.g. of shards.
+
+    Every testcase must only be present in one of the directories. Returns
+    False if any of the merged testcases failed.
+    """
+    sources = {}
+    for directory in directories:
+        for path in sorted(glob.glob(result_path(directory, '*'))):
+            name = os.path.basename(path)[len('test-client-server-'):-len('.json')]
+            if name in sources:
+                raise ValueError("Results of {} found in both {} and {}.".format(
+                    name, os.path.dirname(sources[name]), directory))
+            sources[name] = path
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    result = True
+    for name, path in sorted(sources.items()):
+        with open(path) as stream:
+            data = json.load(stream)
+        if list(data) != [name]:
+            raise ValueError("File {} doesn't contain results of {}.".format(path, name))
+        if data[name]['status'] == result_str[False]:
+            result = False
+        # Event streams are copied along with the results.
+        for suffix in '.json', '.events.jsonl':
+            source = path[:-len('.json')] + suffix
+            target = result_path(outdir, name)[:-len('.json')] + suffix
+            if os.path.exists(source) and os.path.abspath(source) != os.path.abspath(target):
+                shutil.copyfile(source, target)
+    return result
+
+
+worker_pool = None
+
+
+def ignore_interrupt():
+    # Interrupts are left to the parent process, which stops the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_testcase(args):
+    """Run a single testcase in a worker process.
+
+    Every worker uses its own namespace prefix so that workers don't step on
+    each other's network namespaces.
+    """
+    global worker_pool
+
+    name, scenarios, pooled, options = args
+    if pooled and worker_pool is None:
+        worker_pool = TopologyPool()
+        multiprocessing.util.Finalize(worker_pool, worker_pool.destroy, exitpriority=10)
+    testcase = TestCase(name, scenarios, prefix='test-{}'.format(os.getpid()),
+                        pool=worker_pool if pooled else None, **options)
+    testcase.run()
+
+    output = capture_report(testcase)
+    if testcase.writer:
+        testcase.save(testcase.outdir)
+        return TestCaseResult(testcase.name, testcase.result, None, output)
+    return TestCaseResult(testcase.name, testcase.result, testcase.to_dict(), output)
 
 
 class TestSuite:
-    def __init__(self, testcases=None, scenarios=None):
-        self.testcases = [TestCase(name, scenarios) for name in sorted(os.listdir(testcase_path))]
+    def __init__(self, testcases=None, scenarios=None, seccomp=True, pooled=True, early_exit=True,
+                 record=None, replay=None, repeat=1, netem=None, load=None, outdir=None, stream_events=False,
+                 cache=None, database=None, shard=None, durations=None, count_read_write=False):
+        self.scenarios = scenarios
+        self.options = {'seccomp': seccomp, 'early_exit': early_exit, 'record': record, 'replay': replay,
+                        'repeat': repeat, 'netem': netem, 'load': load, 'outdir': outdir,
+                        'stream_events': stream_events, 'count_read_write': count_read_write}
+        # Replayed testcases don't need any namespaces.
+        self.pooled = pooled and not replay
+        self.pool = TopologyPool() if self.pooled else None
+        # Shards running on the same host need their own namespaces.
+        prefix = 'test-shard{}'.format(shard[0]) if shard else 'test'
+        self.testcases = [TestCase(name, scenarios, prefix=prefix, pool=self.pool, **self.options)
+                          for name in sorted(os.listdir(testcase_path))]
         if testcases:
             self.testcases = [testcase for testcase in self.testcases if testcase.name in testcases]
-
-    def run(self):
-        for testcase in self.testcases:
-            testcase.run()
+        if replay:
+            self.testcases = [testcase for testcase in self.testcases if testcase.scenarios]
+        # Expected durations of testcases from an earlier run. Every shard
+        # computes the same assignment given the same testcases and durations.
+        self.durations = load_durations(durations, self.testcases) if durations else {}
+        if shard:
+            index, count = shard
+            names = [testcase.name for testcase in self.testcases]
+            selected = schedule(names, self.durations, count)[0][index - 1]
+            self.testcases = [testcase for testcase in self.testcases if testcase.name in selected]
+        if not durations and outdir:
+            self.durations = load_durations(outdir, self.testcases)
+        # Cached results lack recordings and event streams.
+        self.cache = ResultCache(cache) if cache and not (record or replay or stream_events) else None
+        # Path of the SQLite database to add results to. Replayed results
+        # would show up as new measurements.
+        self.database = database if not replay else None
+        self.started = None
+        # Predicted and actual time to run the testcases that weren't cached.
+        self.predicted = None
+        self.makespan = None
+
+    def run(self, jobs=1, workers=None, callback=None):
+        """Run the testcases that aren't cached.
+
+        Testcases are run in jobs worker processes, workers may be an existing
+        multiprocessing pool of that size. The callback is called with every
+        result as soon as it is available.
+        """
+        self.started = time.time()
+        results = {}
+        if self.cache:
+            for testcase in self.testcases:
+                result = self.cache.lookup(testcase)
+                if result:
+                    results[testcase.name] = result
+                    if callback:
+                        callback(result)
+        # Workers take testcases in order, starting with the longest ones
+        # keeps stragglers from extending the total time.
+        names = [name for name, duration in longest_first(
+            [testcase.name for testcase in self.testcases if testcase.name not in results], self.durations)]
+        if names and all(name in self.durations for name in names):
+            self.predicted = max(schedule(names, self.durations, jobs)[1])
+        started = clock.monotonic()
+        if workers is not None or jobs > 1:
+            pool = workers or multiprocessing.Pool(jobs, ignore_interrupt)
+            testcases = []
+            try:
+                for testcase in pool.imap_unordered(run_testcase,
+                        [(name, self.scenarios, self.pooled, self.options) for name in names], chunksize=1):
+                    testcases.append(testcase)
+                    if callback:
+                        callback(testcase)
+            except KeyboardInterrupt:
+                # Workers ignore the interrupt and would finish their testcases,
+                # kill them and clean up after them instead.
+                if workers is None:
+                    pids = [process.pid for process in multiprocessing.active_children()]
+                    pool.terminate()
+                    for pid in pids:
+                        destroy_namespaces('test-{}-'.format(pid))
+                raise
+            finally:
+                if workers is None:
+                    pool.close()
+                    pool.join()
+        else:
+            testcases = [testcase for testcase in self.testcases if testcase.name in names]
+            try:
+                for testcase in testcases:
+                    testcase.run()
+                    if callback:
+                        callback(testcase)
+            finally:
+                if self.pool is not None:
+                    self.pool.destroy()
+        self.makespan = clock.monotonic() - started
+        results.update((testcase.name, testcase) for testcase in testcases)
+        self.testcases = [results[testcase.name] for testcase in self.testcases]
         self.result = not [testcase.result for testcase in self.testcases if testcase.result is False]
 
     def save(self, outdir):
@@ -488,8 +1663,35 @@ class TestSuite:
             os.mkdir(outdir)
         for testcase in self.testcases:
             testcase.save(outdir)
+            # Failures may be caused by the environment, run them again.
+            if self.cache and testcase.result and not isinstance(testcase, CachedResult):
+                self.cache.store(testcase, outdir)
+        if self.database:
+            self.store(outdir)
+
+    def store(self, outdir):
+        """Add the saved results to the database."""
+        database = ResultDatabase(self.database)
+        try:
+            run = database.add_run(dict(self.options, scenarios=self.scenarios), self.started)
+            for testcase in self.testcases:
+                with open(result_path(outdir, testcase.name)) as stream:
+                    data = json.load(stream)[testcase.name]
+                packages = dependencies(testcase.name)
+                database.add_testcase(run, testcase.name, data, cached=isinstance(testcase, CachedResult),
+                                      packages=package_versions(packages) if packages else None)
+            database.commit()
+        finally:
+            database.close()
 
     def report(self):
         print()
         for testcase in self.testcases:
             testcase.report()
+        if self.predicted is not None:
+            longest = max(self.durations[testcase.name] for testcase in self.testcases
+                          if not isinstance(testcase, CachedResult))
+            print("Testcases took {:.3f} s, {:.3f} s predicted, {:.3f} s at least.".format(
+                self.makespan, self.predicted, longest))
+        elif self.makespan is not None:
+            print("Testcases took {:.3f} s.".format(self.makespan))
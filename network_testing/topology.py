@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""Network namespace topologies for test scenarios.
+
+Namespaces and veth pairs are created by a single `ip -batch` invocation,
+links are brought up and addressed using netlink requests issued from
+inside each namespace and firewall rules are run there without the extra
+`ip netns exec` process. A TopologyPool keeps topologies around and only
+resets them between testcases.
+"""
+import contextlib
+import ctypes
+import os
+import signal
+import socket
+import errno
+import struct
+import subprocess
+import time
+
+CLONE_NEWNET = 0x40000000
+
+NETLINK_ROUTE = 0
+NETLINK_NETFILTER = 12
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFF_UP = 0x1
+RT_SCOPE_UNIVERSE = 0
+# Conntrack table flush, (NFNL_SUBSYS_CTNETLINK << 8) | IPCTNL_MSG_CT_DELETE.
+CTNETLINK_DELETE = 0x0102
+
+netns_dir = '/var/run/netns'
+
+libc = ctypes.CDLL(None, use_errno=True)
+
+
+def netns_path(ns):
+    return os.path.join(netns_dir, ns)
+
+
+def _check(result):
+    if result < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return result
+
+
+def setns(fd):
+    _check(libc.setns(fd, CLONE_NEWNET))
+
+
+@contextlib.contextmanager
+def netns(ns):
+    """Switch the current thread into a named network namespace.
+
+    Sockets created and processes forked inside the block belong to it.
+    """
+    original = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+    try:
+        target = os.open(netns_path(ns), os.O_RDONLY)
+        try:
+            setns(target)
+        finally:
+            os.close(target)
+        try:
+            yield
+        finally:
+            setns(original)
+    finally:
+        os.close(original)
+
+
+def ip_batch(commands):
+    if not commands:
+        return
+    process = subprocess.Popen(['ip', '-batch', '-'], stdin=subprocess.PIPE)
+    process.communicate(''.join(command + '\n' for command in commands).encode())
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, ['ip', '-batch', '-'])
+
+
+class Netlink(object):
+    """Minimal rtnetlink client for the namespace it was created in."""
+
+    def __init__(self, protocol=NETLINK_ROUTE):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, protocol)
+        self.sock.bind((0, 0))
+        self.seq = 0
+
+    def close(self):
+        self.sock.close()
+
+    @staticmethod
+    def _attr(kind, data):
+        length = 4 + len(data)
+        return struct.pack('=HH', length, kind) + data + b'\0' * (-length % 4)
+
+    @staticmethod
+    def _attrs(data, offset, end):
+        attrs = {}
+        while offset + 4 <= end:
+            length, kind = struct.unpack_from('=HH', data, offset)
+            if length < 4:
+                break
+            attrs[kind] = data[offset + 4:offset + length]
+            offset += (length + 3) & ~3
+        return attrs
+
+    def request(self, kind, flags, payload):
+        """Send a request and return the payloads of all reply messages."""
+        self.seq += 1
+        header = struct.pack('=IHHII', 16 + len(payload), kind, NLM_F_REQUEST | NLM_F_ACK | flags, self.seq, 0)
+        self.sock.send(header + payload)
+        replies = []
+        while True:
+            data = self.sock.recv(65536)
+            offset = 0
+            while offset < len(data):
+                length, kind, flags, seq, pid = struct.unpack_from('=IHHII', data, offset)
+                if seq == self.seq:
+                    if kind == NLMSG_ERROR:
+                        error, = struct.unpack_from('=i', data, offset + 16)
+                        if error:
+                            raise OSError(-error, os.strerror(-error))
+                        return replies
+                    if kind == NLMSG_DONE:
+                        return replies
+                    replies.append((kind, data[offset + 16:offset + length]))
+                offset += (length + 3) & ~3
+
+    def index(self, link):
+        return _check(libc.if_nametoindex(link.encode()) or -1)
+
+    def set_up(self, link):
+        payload = struct.pack('=BxHiII', socket.AF_UNSPEC, 0, self.index(link), IFF_UP, IFF_UP)
+        self.request(RTM_NEWLINK, 0, payload)
+
+    def add_address(self, index, family, prefixlen, packed):
+        self._address(RTM_NEWADDR, NLM_F_CREATE | NLM_F_EXCL, index, family, prefixlen, packed)
+
+    def del_address(self, index, family, prefixlen, packed):
+        self._address(RTM_DELADDR, 0, index, family, prefixlen, packed)
+
+    def _address(self, kind, flags, index, family, prefixlen, packed):
+        payload = struct.pack('=BBBBI', family, prefixlen, 0, 0, index)
+        payload += self._attr(IFA_LOCAL, packed) + self._attr(IFA_ADDRESS, packed)
+        self.request(kind, flags, payload)
+
+    def addresses(self, link):
+        """Return global scope addresses of a link as (family, prefixlen, packed) tuples."""
+        index = self.index(link)
+        result = set()
+        for kind, data in self.request(RTM_GETADDR, NLM_F_DUMP, struct.pack('=BBBBI', socket.AF_UNSPEC, 0, 0, 0, 0)):
+            family, prefixlen, flags, scope, ifindex = struct.unpack_from('=BBBBI', data)
+            if ifindex != index or scope != RT_SCOPE_UNIVERSE:
+                continue
+            attrs = self._attrs(data, 8, len(data))
+            packed = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+            if packed:
+                result.add((family, prefixlen, packed))
+        return result
+
+    def flush_conntrack(self):
+        self.request(CTNETLINK_DELETE, 0, struct.pack('=BBH', socket.AF_UNSPEC, 0, 0))
+
+
+def parse_address(address):
+    address, prefixlen = address.split('/')
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    return family, int(prefixlen), socket.inet_pton(family, address)
+
+
+def kill_processes(namespaces):
+    """Kill all processes left running in the given namespaces."""
+    inodes = set()
+    for ns in namespaces:
+        info = os.stat(netns_path(ns))
+        inodes.add((info.st_dev, info.st_ino))
+    pids = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        try:
+            info = os.stat('/proc/{}/ns/net'.format(pid))
+        except OSError:
+            continue
+        if (info.st_dev, info.st_ino) in inodes:
+            try:
+                os.kill(int(pid), signal.SIGKILL)
+            except OSError:
+                continue
+            pids.append(int(pid))
+    # Wait for the processes to release their sockets.
+    deadline = time.time() + 1
+    while pids and time.time() < deadline:
+        pids = [pid for pid in pids if _alive(pid)]
+        if pids:
+            time.sleep(0.001)
+
+
+def destroy_namespaces(prefix):
+    """Remove namespaces of a killed process along with their processes."""
+    namespaces = [ns for ns in os.listdir(netns_dir) if ns.startswith(prefix)] if os.path.isdir(netns_dir) else []
+    kill_processes(namespaces)
+    ip_batch(['netns delete {}'.format(ns) for ns in namespaces])
+
+
+def _alive(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stream:
+            return stream.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError as error:
+        if error.errno == errno.ENOENT:
+            return False
+        raise
+
+
+class Topology(object):
+    def __init__(self):
+        self.namespaces = []
+        self.veths = []
+        self.addresses = []
+        self.rules = []
+
+    def add_netns(self, ns):
+        self.namespaces.append(ns)
+
+    def add_veth(self, ns1, link1, ns2, link2):
+        self.veths.append((ns1, link1, ns2, link2))
+
+    def add_address(self, ns, link, address):
+        self.addresses.append((ns, link, address))
+
+    def add_rule(self, ns, command):
+        self.rules.append((ns, command))
+
+    def spec(self):
+        return self.namespaces, self.veths, self.addresses, self.rules
+
+    def links(self, ns):
+        for ns1, link1, ns2, link2 in self.veths:
+            if ns1 == ns:
+                yield link1
+            if ns2 == ns:
+                yield link2
+
+    def create(self):
+        commands = self._delete_commands()
+        commands += ['netns add {}'.format(ns) for ns in self.namespaces]
+        commands += ['link add dev {1} netns {0} type veth peer name {3} netns {2}'.format(*veth) for veth in self.veths]
+        ip_batch(commands)
+        try:
+            self._configure()
+        except BaseException:
+            # Don't leave half configured namespaces behind.
+            self.destroy()
+            raise
+
+    def _configure(self):
+        for ns in self.namespaces:
+            with netns(ns):
+                rtnl = Netlink()
+                try:
+                    for link in ['lo'] + list(self.links(ns)):
+                        rtnl.set_up(link)
+                    for address_ns, link, address in self.addresses:
+                        if address_ns == ns:
+                            rtnl.add_address(rtnl.index(link), *parse_address(address))
+                finally:
+                    rtnl.close()
+                for rule_ns, command in self.rules:
+                    if rule_ns == ns:
+                        subprocess.check_call(command)
+
+    def reset(self):
+        """Bring an existing topology back to its freshly created state.
+
+        Stray processes are killed, links brought up, connection tracking
+        flushed and addresses restored. Return False when the topology is
+        broken and needs to be created again.
+        """
+        try:
+            kill_processes(self.namespaces)
+            for ns in self.namespaces:
+                with netns(ns):
+                    rtnl = Netlink()
+                    try:
+                        for link in ['lo'] + list(self.links(ns)):
+                            rtnl.set_up(link)
+                        for link in self.links(ns):
+                            wanted = set(parse_address(address) for address_ns, address_link, address in self.addresses
+                                         if address_ns == ns and address_link == link)
+                            present = rtnl.addresses(link)
+                            for address in present - wanted:
+                                rtnl.del_address(rtnl.index(link), *address)
+                            for address in wanted - present:
+                                rtnl.add_address(rtnl.index(link), *address)
+                    finally:
+                        rtnl.close()
+                    self._flush_conntrack()
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _flush_conntrack():
+        try:
+            rtnl = Netlink(NETLINK_NETFILTER)
+        except socket.error:
+            return
+        try:
+            rtnl.flush_conntrack()
+        except OSError:
+            # Conntrack is not loaded, there is nothing to flush.
+            pass
+        finally:
+            rtnl.close()
+
+    def destroy(self):
+        ip_batch(self._delete_commands())
+
+    def _delete_commands(self):
+        return ['netns delete {}'.format(ns) for ns in self.namespaces if os.path.exists(netns_path(ns))]
+
+
+class TopologyPool(object):
+    """Topologies kept alive between testcases, keyed by scenario class."""
+
+    def __init__(self):
+        self.topologies = {}
+
+    def create(self, key, topology):
+        existing = self.topologies.pop(key, None)
+        if existing is not None:
+            if existing.spec() == topology.spec() and existing.reset():
+                self.topologies[key] = existing
+                return existing
+            existing.destroy()
+        topology.create()
+        self.topologies[key] = topology
+        return topology
+
+    def destroy(self):
+        for topology in self.topologies.values():
+            topology.destroy()
+        self.topologies = {}
@@ -14,7 +14,9 @@ setup(
     entry_points={
         'console_scripts': [
             'test-client-server = network_testing.client_server:main',
-            'test-client-server-genhtml = network_testing.client_server_genhtml:main'
+            'test-client-server-genhtml = network_testing.client_server_genhtml:main',
+            'test-client-server-query = network_testing.client_server_query:main',
+            'test-client-server-submit = network_testing.client_server_submit:main'
         ]
     },
     package_data={
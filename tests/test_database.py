@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+
+from network_testing import test_suite
+from network_testing.database import ResultDatabase, changed
+
+recordings = os.path.join(os.path.dirname(__file__), 'data', 'recordings')
+
+
+def replayed_result():
+    testcase = test_suite.TestCase('python', ['dualstack'], replay=recordings)
+    testcase.run()
+    return testcase.to_dict()
+
+
+def with_property(data, name, value, status):
+    properties = dict(data['properties'])
+    properties[name] = {'value': value, 'status': status}
+    return dict(data, properties=properties)
+
+
+class DatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.database = ResultDatabase(':memory:')
+        self.data = replayed_result()
+
+    def tearDown(self):
+        self.database.close()
+
+    def add_run(self, data, cached=False, name='python', started=None):
+        run = self.database.add_run({'jobs': 1}, started)
+        self.database.add_testcase(run, name, data, cached)
+        self.database.commit()
+        return run
+
+    def test_scenarios(self):
+        self.add_run(self.data)
+        execute = self.database.connection.execute
+        self.assertEqual(execute("SELECT name, errors, tracer_stops FROM scenarios").fetchall(),
+                         [('dualstack', '[]', 598)])
+        # The two listeners and the connection with all of their events.
+        self.assertEqual(execute("SELECT socket, socket_index, COUNT(*) FROM events "
+                                 "GROUP BY socket, socket_index ORDER BY socket, socket_index").fetchall(),
+                         [('connection', 0, 4), ('listener', 0, 4), ('listener', 1, 4)])
+
+    def test_runs(self):
+        first = self.add_run(self.data, started=1.0)
+        second = self.add_run(with_property(self.data, 'errors', 1, 'FAIL'), started=2.0)
+        self.database.add_testcase(second, 'ssh', dict(self.data, status='FAIL'))
+        third = self.add_run(self.data, cached=True, started=3.0)
+        runs = [(run[0], run[1], run[3], run[4], run[5]) for run in self.database.runs()]
+        self.assertEqual(runs, [(third, 3.0, 1, 0, 1), (second, 2.0, 2, 1, 0), (first, 1.0, 1, 0, 0)])
+        self.assertEqual([run[0] for run in self.database.runs(limit=1)], [third])
+
+    def test_trend(self):
+        first = self.add_run(self.data)
+        second = self.add_run(with_property(self.data, 'connect-latency', 0.5, 'INFO'))
+        # Cached results are no new measurements.
+        self.add_run(self.data, cached=True)
+        trend = [(run, value, status) for run, started, value, status, packages
+                 in self.database.trend('python', 'connect-latency')]
+        self.assertEqual(trend, [(first, 0.000142442, 'INFO'), (second, 0.5, 'INFO')])
+        self.assertEqual(self.database.trend('python', 'unknown'), [])
+
+    def test_regressions(self):
+        self.add_run(self.data)
+        data = with_property(self.data, 'ip6-listener', False, 'FAIL')
+        data = with_property(data, 'connect-latency', 0.0003, 'INFO')
+        data = with_property(data, 'establish-time', 0.5, 'INFO')
+        second = self.add_run(data)
+        self.add_run(self.data, cached=True)
+        # The latest run that isn't cached is compared by default, small
+        # float changes are ignored.
+        for run in None, second:
+            self.assertEqual(list(self.database.regressions(run)), [
+                ('python', 'establish-time', 0.000142442, 'INFO', 0.5, 'INFO'),
+                ('python', 'ip6-listener', 1, 'PASS', 0, 'FAIL'),
+            ])
+        self.assertEqual(list(self.database.regressions(second, threshold=0.01))[0][1], 'connect-latency')
+
+    def test_changed(self):
+        self.assertFalse(changed(1.0, 1.4, 0.5))
+        self.assertTrue(changed(1.0, 1.6, 0.5))
+        # Tiny values are compared against a floor.
+        self.assertFalse(changed(0.0, 0.0004, 0.5))
+        self.assertTrue(changed(1, 2, 0.5))
+        self.assertFalse(changed('a', 'a', 0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import socket
+import struct
+import unittest
+
+from network_testing.events import Address, Exit, Ready, dump_events, event_records, load_events
+
+recording_path = os.path.join(os.path.dirname(__file__), 'data', 'recordings', 'python', 'dualstack.json')
+
+
+def load_recording():
+    with open(recording_path) as stream:
+        return json.load(stream)
+
+
+def sockaddr_in(address, port):
+    return struct.pack('=H', socket.AF_INET) + struct.pack('!H', port) + socket.inet_pton(socket.AF_INET, address) \
+        + b'\0' * 8
+
+
+def sockaddr_in6(address, port, scope):
+    return struct.pack('=H', socket.AF_INET6) + struct.pack('!HI', port, 0) \
+        + socket.inet_pton(socket.AF_INET6, address) + struct.pack('=I', scope)
+
+
+class EventsTest(unittest.TestCase):
+    def test_round_trip(self):
+        data = load_recording()
+        events = load_events(data)
+        self.assertEqual(dump_events(events), {'sockets': data['sockets'], 'events': data['events']})
+
+    def test_socket_events(self):
+        events = load_events(load_recording())
+        listen = [event for event in events if event.name == 'listen'][0]
+        self.assertIn(listen, listen.socket.events)
+        self.assertEqual(listen.socket.domain.value, socket.AF_INET)
+        self.assertEqual(str(listen), "[0.152 server 22978] listen(3, 4096) = 0 <0.000052>")
+        exits = [event for event in events if isinstance(event, Exit)]
+        self.assertEqual([event.origin for event in exits], ['server', 'client'])
+
+    def test_records(self):
+        events = load_events(load_recording())
+        sockets = []
+        items = []
+        for record in event_records(events):
+            kind = record.pop('record')
+            if kind == 'socket':
+                self.assertEqual(record.pop('index'), len(sockets))
+                sockets.append(record)
+            else:
+                # Sockets are emitted before the first event using them.
+                if record.get('socket') is not None:
+                    self.assertLess(record['socket'], len(sockets))
+                items.append(record)
+        self.assertEqual({'sockets': sockets, 'events': items}, dump_events(events))
+
+    def test_ready(self):
+        events = load_events(load_recording())
+        sock = [event.socket for event in events if event.name == 'connect' and event.origin == 'client'][-1]
+        ready = Ready('client', 22979, 22979, 'poll', 3, 4, 266500000, sock)
+        sock.events.append(ready)
+        loaded = load_events(dump_events(events + [ready]))[-1]
+        self.assertIsInstance(loaded, Ready)
+        self.assertEqual(str(loaded), str(ready))
+        self.assertIn(loaded, loaded.socket.events)
+
+
+class AddressTest(unittest.TestCase):
+    def test_ip4(self):
+        address = Address.unpack(sockaddr_in('192.0.2.1', 80))
+        self.assertEqual(address.to_list(), [socket.AF_INET, '192.0.2.1', 80, 0])
+        self.assertEqual(str(address), "<AF_INET 192.0.2.1:80>")
+
+    def test_ip6(self):
+        address = Address.unpack(sockaddr_in6('fe80::1', 443, 2))
+        self.assertEqual(address.to_list(), [socket.AF_INET6, 'fe80::1', 443, 2])
+        self.assertEqual(str(address), "<AF_INET6 [fe80::1%2]:443>")
+        self.assertEqual(str(Address.unpack(sockaddr_in6('2001:db8::1', 80, 0))), "<AF_INET6 [2001:db8::1]:80>")
+
+    def test_other_family(self):
+        address = Address.unpack(struct.pack('=H', socket.AF_UNIX) + b'/run/socket\0')
+        self.assertEqual(address.to_list(), [socket.AF_UNIX, None, None, None])
+        self.assertEqual(str(address), "<AF_UNIX>")
+
+    def test_truncated(self):
+        self.assertIsNone(Address.unpack(b''))
+        self.assertIsNone(Address.unpack(b'\0'))
+        self.assertIsNone(Address.unpack(sockaddr_in('192.0.2.1', 80)[:6]))
+        self.assertIsNone(Address.unpack(sockaddr_in6('2001:db8::1', 80, 0)[:24]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import socket
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from network_testing.events import Argument, Event, Socket
+
+try:
+    from network_testing import debug
+except ImportError:
+    debug = None
+
+
+def new_socket(fd):
+    return Socket(fd, Argument(socket.AF_INET, 'AF_INET'), Argument(socket.SOCK_STREAM, 'SOCK_STREAM'),
+                  Argument(0, '0'))
+
+
+def syscall(name, result, *args, **kwargs):
+    """Event of a syscall as the tracer decodes it, entered right before it exited."""
+    exited = kwargs.get('exited', 1000)
+    return Event.from_dict({
+        'origin': 'server',
+        'pid': 1,
+        'name': name,
+        'result': result,
+        'arguments': [[arg, str(arg)] for arg in args],
+        'entered': exited - 1,
+        'exited': exited,
+        'socket': None,
+    }, [])
+
+
+@unittest.skipIf(debug is None, "Requires python-ptrace.")
+class FileTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = debug.FileTable()
+        self.sock = new_socket(3)
+        self.table.add(3, self.sock, False, 100)
+
+    def test_close(self):
+        self.assertIs(self.table.remove(3, 200), self.sock)
+        self.assertEqual(self.sock.references, 0)
+        self.assertEqual(self.sock.released, 200)
+        self.assertIsNone(self.table.remove(3, 300))
+
+    def test_dup(self):
+        self.assertIs(debug.SyscallDebugger.duplicate(self.table, syscall('dup', 4, 3)), self.sock)
+        self.assertIs(self.table.get(4), self.sock)
+        self.table.remove(3, 200)
+        self.assertIsNone(self.sock.released)
+        self.table.remove(4, 300)
+        self.assertEqual(self.sock.released, 300)
+
+    def test_dup2(self):
+        other = new_socket(4)
+        self.table.add(4, other, False, 100)
+        duplicate = debug.SyscallDebugger.duplicate
+        # The target descriptor is closed first.
+        self.assertIs(duplicate(self.table, syscall('dup2', 4, 3, 4, exited=200)), other)
+        self.assertEqual(other.released, 200)
+        self.assertIs(self.table.get(4), self.sock)
+        self.assertEqual(self.sock.references, 2)
+        # Duplicating a descriptor onto itself does nothing.
+        duplicate(self.table, syscall('dup2', 3, 3, 3))
+        self.assertEqual(self.sock.references, 2)
+        # Other files replacing a socket close it as well.
+        duplicate(self.table, syscall('dup3', 4, 0, 4, debug.O_CLOEXEC, exited=300))
+        self.assertIsNone(self.table.get(4))
+        self.assertEqual(self.sock.references, 1)
+
+    def test_exec(self):
+        duplicate = debug.SyscallDebugger.duplicate
+        duplicate(self.table, syscall('fcntl', 5, 3, debug.F_DUPFD_CLOEXEC, 0))
+        duplicate(self.table, syscall('dup3', 6, 3, 6, debug.O_CLOEXEC))
+        duplicate(self.table, syscall('fcntl', 0, 3, debug.F_SETFD, debug.FD_CLOEXEC))
+        self.assertEqual(self.table.cloexec, set([3, 5, 6]))
+        duplicate(self.table, syscall('fcntl', 0, 6, debug.F_SETFD, 0))
+        self.table.execute(400)
+        self.assertEqual(sorted(self.table.files), [6])
+        self.assertEqual(self.sock.references, 1)
+        self.assertIsNone(self.sock.released)
+
+    def test_fork(self):
+        child = self.table.copy()
+        self.assertEqual(self.sock.references, 2)
+        child.release(200)
+        self.assertIsNone(self.sock.released)
+        # Tables shared with clone(CLONE_FILES) are closed by the last user.
+        self.table.users += 1
+        self.table.release(300)
+        self.assertIsNone(self.sock.released)
+        self.table.release(400)
+        self.assertEqual(self.sock.released, 400)
+
+    def test_reused(self):
+        # Another thread closed descriptor 3 and got it for a new socket
+        # before the close was processed.
+        other = new_socket(3)
+        self.table.add(3, other, False, 200)
+        self.assertIs(self.table.remove(3, 300, entered=150), self.sock)
+        self.assertEqual(self.sock.released, 300)
+        self.assertIs(self.table.get(3), other)
+        self.assertIsNone(other.released)
+
+    def test_rights(self):
+        debugger = debug.SyscallDebugger(seccomp=False)
+        receiver = debug.FileTable()
+        with mock.patch.object(debug, 'read_rights', return_value=[3]):
+            debugger.pass_rights(None, self.table, syscall('sendmsg', 1, 7, 0, 0))
+        self.assertEqual(len(debugger.in_flight), 1)
+        # The sender closes its descriptor while the socket is in flight.
+        self.table.remove(3, 200)
+        with mock.patch.object(debug, 'read_rights', return_value=[5]):
+            debugger.pass_rights(None, receiver, syscall('recvmsg', 1, 8, 0, debug.MSG_CMSG_CLOEXEC, exited=300))
+        self.assertEqual(debugger.in_flight, [])
+        self.assertIs(receiver.get(5), self.sock)
+        self.assertEqual(receiver.cloexec, set([5]))
+        self.assertEqual(self.sock.references, 1)
+        # Messages without a matching one in flight are ignored.
+        with mock.patch.object(debug, 'read_rights', return_value=[6]):
+            debugger.pass_rights(None, receiver, syscall('recvmsg', 1, 8, 0, 0))
+        self.assertIsNone(receiver.get(6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+
+from network_testing import test_suite
+
+
+def installed(command):
+    return any(os.access(os.path.join(directory, command), os.X_OK)
+               for directory in os.environ.get('PATH', '').split(os.pathsep))
+
+
+class LoadScenarioTest(unittest.TestCase):
+    def test_default_options(self):
+        testcase = test_suite.TestCase('python', ['load'])
+        scenario, = testcase.scenarios
+        self.assertIsInstance(scenario, test_suite.LoadScenario)
+        self.assertEqual(scenario.duration, test_suite.LoadScenario.duration)
+        self.assertIsNone(scenario.run_duration)
+
+    @unittest.skipUnless(os.geteuid() == 0, "Tracing requires root.")
+    @unittest.skipUnless(installed('ip') and installed('wrapresolve'), "Requires iproute2 and netresolve.")
+    def test_run_default_options(self):
+        testcase = test_suite.TestCase('python3-asyncio', ['load'], load={'server_only': False})
+        testcase.run()
+        scenario, = testcase.scenarios
+        self.assertEqual(scenario.errors, [])
+        self.assertGreater(scenario.workload['clients'], 0)
+        self.assertGreater(testcase.properties[test_suite.AcceptRate].value, 0)
+        self.assertIsNotNone(scenario.run_duration)
+        self.assertEqual(testcase.to_dict()['scenarios'][0]['duration'], scenario.run_duration)
+
+
+if __name__ == '__main__':
+    unittest.main()
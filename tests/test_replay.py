@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from network_testing import test_suite
+
+recordings = os.path.join(os.path.dirname(__file__), 'data', 'recordings')
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def value(self, testcase, cls):
+        return testcase.properties[cls].value
+
+    def test_analyze(self):
+        testcase = test_suite.TestCase('python', ['dualstack'], replay=recordings)
+        testcase.run()
+        scenario, = testcase.scenarios
+        self.assertEqual(scenario.errors, [])
+        self.assertEqual([str(sock) for sock in scenario.listeners],
+                         ['Socket(3/AF_INET/SOCK_STREAM|SOCK_CLOEXEC/6)', 'Socket(4/AF_INET6/SOCK_STREAM|SOCK_CLOEXEC/6)'])
+        # Resolver sockets aren't connections to the server.
+        conn, = scenario.connections
+        self.assertFalse(conn.nonblocking)
+        self.assertTrue(conn.shutdown)
+        self.assertIsNotNone(conn.closed)
+        self.assertAlmostEqual(conn.established, 0.000142442)
+        self.assertIsNone(conn.failed)
+        self.assertEqual(scenario.ready_saved, 0.0)
+
+    def test_properties(self):
+        testcase = test_suite.TestCase('python', ['dualstack'], replay=recordings)
+        testcase.run()
+        self.assertTrue(testcase.result)
+        self.assertIs(self.value(testcase, test_suite.IP4Listener), True)
+        self.assertIs(self.value(testcase, test_suite.IP6Listener), True)
+        self.assertIs(self.value(testcase, test_suite.ParallelConnect), False)
+        self.assertAlmostEqual(self.value(testcase, test_suite.ConnectLatency), 0.000142442)
+        self.assertAlmostEqual(self.value(testcase, test_suite.EstablishTime), 0.000142442)
+        self.assertEqual(self.value(testcase, test_suite.Errors), 0)
+        data = testcase.to_dict()
+        self.assertEqual(data['status'], 'PASS')
+        self.assertEqual(data['properties']['ip6-listener'], {'value': True, 'status': 'PASS'})
+        self.assertEqual([scenario['name'] for scenario in data['scenarios']], ['dualstack'])
+
+    def write_recording(self, name, data):
+        path = os.path.join(self.directory, 'python', name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as stream:
+            json.dump(data, stream)
+
+    def test_repeat(self):
+        with open(os.path.join(recordings, 'python', 'dualstack.json')) as stream:
+            data = json.load(stream)
+        self.write_recording('dualstack.json', data)
+        # A second run with a slower connect and without the IPv6 listener.
+        for event in data['events']:
+            if event['name'] == 'connect' and event['origin'] == 'client' and event['result'] == 0:
+                event['entered'] -= 1000000
+            if event['name'] == 'listen' and event['arguments'][0][0] == 4:
+                event['name'] = 'getsockname'
+        self.write_recording('dualstack-2.json', data)
+
+        testcase = test_suite.TestCase('python', ['dualstack'], replay=self.directory, repeat=2)
+        testcase.run()
+        scenario, = testcase.scenarios
+        stats = testcase.properties[test_suite.ConnectLatency].stats
+        self.assertEqual(stats['count'], 2)
+        self.assertAlmostEqual(stats['min'], 0.000142442)
+        self.assertAlmostEqual(stats['max'], 0.001142442)
+        self.assertAlmostEqual(self.value(testcase, test_suite.ConnectLatency), 0.000642442)
+        # The details are those of the first run, disagreements are errors.
+        self.assertIs(self.value(testcase, test_suite.IP6Listener), True)
+        self.assertEqual(scenario.errors, ["Run 2: ip6-listener is False instead of True."])
+        self.assertEqual(self.value(testcase, test_suite.Errors), 1)
+        self.assertFalse(testcase.result)
+
+
+class StatisticsTest(unittest.TestCase):
+    def test_even(self):
+        stats = test_suite.statistics([3.0, 1.0, 2.0, 4.0])
+        self.assertEqual(stats['count'], 4)
+        self.assertEqual(stats['min'], 1.0)
+        self.assertEqual(stats['median'], 2.5)
+        self.assertEqual(stats['p95'], 4.0)
+        self.assertEqual(stats['max'], 4.0)
+        self.assertAlmostEqual(stats['stddev'], (5 / 3.0) ** 0.5)
+
+    def test_odd(self):
+        stats = test_suite.statistics([float(value) for value in range(21, 0, -1)])
+        self.assertEqual(stats['median'], 11.0)
+        self.assertEqual(stats['p95'], 20.0)
+
+    def test_single(self):
+        stats = test_suite.statistics([0.5])
+        self.assertEqual((stats['min'], stats['median'], stats['p95'], stats['max']), (0.5,) * 4)
+        self.assertEqual(stats['stddev'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
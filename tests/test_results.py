@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from network_testing import test_suite
+from network_testing.test_suite import result_path
+
+recordings = os.path.join(os.path.dirname(__file__), 'data', 'recordings')
+
+
+def read(path):
+    with open(path) as stream:
+        return stream.read()
+
+
+class ScheduleTest(unittest.TestCase):
+    durations = {'a': 4.0, 'b': 3.0, 'c': 2.0}
+
+    def test_longest_first(self):
+        # Unknown durations are expected to be average, ties go by name.
+        self.assertEqual(test_suite.longest_first(['c', 'd', 'b', 'a'], self.durations),
+                         [('a', 4.0), ('b', 3.0), ('d', 3.0), ('c', 2.0)])
+        self.assertEqual(test_suite.longest_first(['b', 'a'], {}), [('a', 1.0), ('b', 1.0)])
+
+    def test_schedule(self):
+        bins, totals = test_suite.schedule(['a', 'b', 'c', 'd'], self.durations, 2)
+        self.assertEqual(bins, [['a', 'c'], ['b', 'd']])
+        self.assertEqual(totals, [6.0, 6.0])
+        bins, totals = test_suite.schedule(['a'], self.durations, 3)
+        self.assertEqual(bins, [['a'], [], []])
+        self.assertEqual(totals, [4.0, 0.0, 0.0])
+
+
+class ResultFilesTest(unittest.TestCase):
+    data = {'status': 'PASS', 'duration': 2.0, 'properties': {'errors': {'value': 0, 'status': 'PASS'}}}
+    scenarios = [{'name': 'loopback', 'duration': 0.5, 'errors': []},
+                 {'name': 'dualstack', 'duration': 1.0, 'errors': [{'str': "Client timeout occured."}]}]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def save(self, outdir, name, status='PASS'):
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        test_suite.save_result(outdir, name, dict(self.data, status=status, scenarios=self.scenarios))
+
+    def test_splice(self):
+        os.makedirs(self.path('streamed'))
+        for scenarios in self.scenarios, []:
+            test_suite.save_result(self.directory, 'python', dict(self.data, scenarios=scenarios))
+            test_suite.save_result(self.path('streamed'), 'python', self.data, iter(scenarios))
+            self.assertEqual(read(result_path(self.path('streamed'), 'python')), read(result_path(self.directory, 'python')))
+
+    def test_writer(self):
+        writer = test_suite.ResultWriter(self.path('out'), 'python')
+        for scenario in self.scenarios:
+            writer.add_scenario(scenario)
+        self.assertEqual(list(writer.scenarios()), self.scenarios)
+        writer.save(self.directory, self.data)
+        self.save(self.path('expected'), 'python')
+        self.assertEqual(read(result_path(self.directory, 'python')), read(result_path(self.path('expected'), 'python')))
+        self.assertFalse(os.path.exists(writer.path))
+
+    def test_writer_events(self):
+        testcase = test_suite.TestCase('python', ['dualstack'], replay=recordings, outdir=self.directory,
+                                       stream_events=True)
+        testcase.run()
+        testcase.save(self.directory)
+        with open(result_path(self.directory, 'python')) as stream:
+            scenario, = json.load(stream)['python']['scenarios']
+        self.assertEqual(scenario['name'], 'dualstack')
+        with open(testcase.writer.events_path) as stream:
+            records = [json.loads(line) for line in stream]
+        with open(os.path.join(recordings, 'python', 'dualstack.json')) as stream:
+            recording = json.load(stream)
+        self.assertEqual([record for record in records if record['record'] == 'event'][-1]['name'], 'exit')
+        self.assertEqual(len(records), len(recording['sockets']) + len(recording['events']))
+        self.assertTrue(all(record['scenario'] == 'dualstack' and record['run'] == 1 for record in records))
+
+    def test_merge(self):
+        self.save(self.path('shard1'), 'python')
+        self.save(self.path('shard2'), 'ssh', status='FAIL')
+        open(result_path(self.path('shard2'), 'ssh')[:-len('.json')] + '.events.jsonl', 'w').close()
+        self.assertFalse(test_suite.merge_results([self.path('shard1'), self.path('shard2')], self.path('merged')))
+        self.assertEqual(sorted(os.listdir(self.path('merged'))),
+                         ['test-client-server-python.json', 'test-client-server-ssh.events.jsonl',
+                          'test-client-server-ssh.json'])
+        self.assertEqual(read(result_path(self.path('merged'), 'python')), read(result_path(self.path('shard1'), 'python')))
+        self.assertTrue(test_suite.merge_results([self.path('shard1')], self.path('shard1')))
+
+    def test_merge_duplicate(self):
+        self.save(self.path('shard1'), 'python')
+        self.save(self.path('shard2'), 'python')
+        self.assertRaises(ValueError, test_suite.merge_results, [self.path('shard1'), self.path('shard2')],
+                          self.path('merged'))
+
+    def test_load_durations(self):
+        self.save(self.directory, 'python')
+        self.save(self.directory, 'ssh')
+        # Files of an interrupted run.
+        with open(result_path(self.directory, 'ssh'), 'r+') as stream:
+            stream.truncate(10)
+        open(result_path(self.directory, 'vsftpd'), 'w').close()
+        testcases = [test_suite.TestCase(name, ['loopback', 'dualstack']) for name in ('python', 'ssh', 'vsftpd')]
+        self.assertEqual(test_suite.load_durations(self.directory, testcases), {'python': 1.5})
+        # The whole testcase is used when a selected scenario is unknown.
+        testcases = [test_suite.TestCase('python', ['dualstack', 'v6rejected'])]
+        self.assertEqual(test_suite.load_durations(self.directory, testcases), {'python': 2.0})
+        testcases = [test_suite.TestCase('python', ['dualstack'])]
+        self.assertEqual(test_suite.load_durations(self.directory, testcases), {'python': 1.0})
+
+
+if __name__ == '__main__':
+    unittest.main()